@@ -0,0 +1,334 @@
+"""Offline benchmark: web routes and /start against a fake Bot API and a throwaway catalog.
+
+    python bench.py --videos 100000 --requests 2000 --concurrency 32 --output bench.json
+    python bench.py --mongo mock --videos 20000          # in-process mongomock, no server needed
+
+cold_start times fresh processes: the import profile of web and bot (python -X importtime) and how
+long a new web process takes to answer /healthz and then render /. The other scenarios share one
+warm process: the web tier runs in a threaded werkzeug server and /start updates go straight to the PTB
+application, all in this process. Telegram is replaced by a local HTTP stand-in, optionally with
+--api-latency of simulated round trip. With --mongo uri (the default) the `--db` database on
+MONGODB_URI is DROPPED and reseeded; mongomock has no $text support, so search is skipped there.
+Results are printed as JSON (and written to --output) with the commit they were measured on.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from collections import Counter
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+WORDS = ['night', 'city', 'ocean', 'fire', 'ghost', 'summer', 'river', 'storm', 'shadow', 'garden', 'dream', 'road']
+SCENARIOS = ['cold_start', 'index', 'api_videos', 'file', 'thumbnail', 'search', 'start']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Answers Bot API calls with the smallest valid result for each method."""
+    calls = Counter()
+    latency = 0.0
+    _ids = iter(range(1, 1 << 62))
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        fields = {}
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            fields = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        with self._lock:
+            self.calls[method] += 1
+            message_id = next(self._ids)
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps({'ok': True, 'result': self.result(method, fields, message_id)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    @staticmethod
+    def result(method, fields, message_id):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'getChatMember':
+            return {'status': 'member', 'user': {'id': int(fields.get('user_id', 0)), 'is_bot': False, 'first_name': 'Load'}}
+        if method == 'getUpdates':
+            return []
+        if method.startswith('send'):
+            chat_id = int(fields.get('chat_id', 0) or 0)
+            return {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        return True
+
+def start_fake_bot_api(latency):
+    FakeBotAPI.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), FakeBotAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure(args, api_port):
+    # Everything below reads config at import time, so the environment is set up first
+    os.environ.update(
+        BOT_TOKEN='123456:bench', BOT_USERNAME='bench_bot', ADMIN_ID='1', CHANNEL_ID='-100100',
+        UPDATES_CHANNEL='@bench_updates', CAPTCHA_URL='https://example.com', TUTORIAL_URL='https://example.com',
+        LOG_CHANNEL='-100200', ANIME_CHANNEL_ID='-100300', DB_NAME=args.db, APP_ROLE='all', STATS_INTERVAL='3600',
+        BOT_API_URL=f"http://127.0.0.1:{api_port}/bot", BOT_API_FILE_URL=f"http://127.0.0.1:{api_port}/file/bot",
+        OUTBOUND_RATE=str(args.outbound_rate)
+    )
+    os.environ['MONGODB_URI'] = args.mongodb_uri
+    if args.mongo == 'mock':
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    # Keep the seeded thumbnail files out of the checkout
+    os.environ['THUMBNAILS_DIR'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'thumbnails')
+    sys.path.insert(0, REPO)
+
+def seed(n_videos, n_thumbs, n_users):
+    import store
+    from config import CATEGORIES, DEFAULT_CATEGORY, THUMBNAILS_DIR
+    store.client.drop_database(store.db.name)
+    store.ensure_indexes()
+    rng = random.Random(42)
+    categories = sorted(CATEGORIES - {DEFAULT_CATEGORY})
+    started = time.perf_counter()
+    for offset in range(0, n_videos, 10000):
+        store.videos.insert_many([{
+            'file_id': f"bench-file-{i}",
+            'custom_key': f"file_bench{i}",
+            'title': ' '.join(rng.sample(WORDS, 3)) + f" {i}",
+            'thumbnail_url': f"/thumbnails/file_bench{i}.jpg",
+            'thumbnail_path': f"static/thumbnails/file_bench{i}.jpg" if i < n_thumbs else None,
+            'type': 'video',
+            'category': categories[i % len(categories)] if categories and i % 5 == 0 else DEFAULT_CATEGORY
+        } for i in range(offset, min(offset + 10000, n_videos))])
+    jpeg = b'\xff\xd8\xff\xe0' + bytes(2048) + b'\xff\xd9'
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    for i in range(n_thumbs):
+        with open(os.path.join(THUMBNAILS_DIR, f"file_bench{i}.jpg"), 'wb') as f:
+            f.write(jpeg)
+    now = datetime.utcnow()
+    store.users.insert_many([{'user_id': 1_000_000 + i, 'last_verified': now} for i in range(n_users)])
+    return time.perf_counter() - started
+
+def start_web():
+    import logging
+    from werkzeug.serving import make_server
+    from web import app  # indexes the seeded thumbnails on import
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', free_port(), app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+async def measure(requests, concurrency, call):
+    """Run `call(i)` for i in range(requests) with `concurrency` in flight; returns the summary."""
+    from webhook_harness import percentile
+    slots = asyncio.Semaphore(concurrency)
+    latencies, errors = [], Counter()
+    async def one(i):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'errors': dict(errors),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+def web_scenarios(args, rng):
+    import store
+    from web import encode_cursor
+    sample = list(store.videos.aggregate([{'$sample': {'size': 500}}])) if args.mongo != 'mock' else \
+        list(store.videos.find().limit(500))
+    cursors = [encode_cursor(d['_id']) for d in sample]
+    keys = [d['custom_key'] for d in sample]
+    thumbs = [f"file_bench{rng.randrange(max(args.thumbnails, 1))}" for _ in range(500)]
+    headers = {'Accept-Encoding': 'gzip, br'}
+    return {
+        'index': lambda client, i: client.get('/', headers=headers),
+        'api_videos': lambda client, i: client.get('/api/videos', params={'cursor': cursors[i % len(cursors)]}, headers=headers),
+        'file': lambda client, i: client.get(f"/file/{keys[i % len(keys)]}"),
+        'thumbnail': lambda client, i: client.get(f"/thumbnails/{thumbs[i % len(thumbs)]}.jpg"),
+        'search': lambda client, i: client.get('/api/search', params={'q': WORDS[i % len(WORDS)]})
+    }
+
+async def run_web(args, base_url, selected, rng):
+    import httpx
+    scenarios = web_scenarios(args, rng)
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for name in selected:
+            async def call(i, request=scenarios[name]):
+                r = await request(client, i)
+                if r.status_code >= 400:
+                    raise RuntimeError(f"HTTP {r.status_code}")
+            await measure(min(args.warmup, args.requests), args.concurrency, call)
+            results[name] = await measure(args.requests, args.concurrency, call)
+    return results
+
+async def run_start(args, rng):
+    import bot
+    from telegram import Update
+    from webhook_harness import start_update
+    bot.register_handlers()
+    keys = [f"file_bench{rng.randrange(args.videos)}" for _ in range(1000)]
+    async with bot.application:
+        async def call(i):
+            data = start_update(1_000_000 + i % args.users, keys[i % len(keys)])
+            await bot.application.process_update(Update.de_json(data, bot.application.bot))
+        await measure(min(args.warmup, args.requests), args.concurrency, call)
+        return await measure(args.requests, args.concurrency, call)
+
+def import_profile(module, top=10):
+    """Total import time of `module` in a fresh interpreter and its slowest direct imports, in ms."""
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                       cwd=REPO, capture_output=True, text=True)
+    total, children = None, []
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == module:
+            total = int(cumulative) / 1000
+        elif depth == 1:
+            children.append([name.strip(), int(cumulative) / 1000])
+    children.sort(key=lambda c: -c[1])
+    return {'total_ms': total, 'slowest': children[:top]}
+
+def cold_start(args):
+    import httpx
+    from webhook_harness import percentile
+    port = free_port()
+    code = f"from web import app; app.run(host='127.0.0.1', port={port})"
+    ready, first_page = [], []
+    for _ in range(args.cold_runs):
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-c', code], cwd=REPO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while time.perf_counter() - started < 60:
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}/healthz", timeout=1).status_code == 200:
+                        ready.append(time.perf_counter() - started)
+                        break
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+            # mongomock lives in this process only, so a fresh one can't render pages
+            if args.mongo != 'mock' and ready:
+                t = time.perf_counter()
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=30).status_code == 200:
+                    first_page.append(time.perf_counter() - t)
+        finally:
+            proc.terminate()
+            proc.wait()
+    def summary(values):
+        return {'p50_ms': round(percentile(values, 50) * 1000, 1), 'max_ms': round(max(values) * 1000, 1)} if values else None
+    return {
+        'runs': args.cold_runs,
+        'healthz_ready': summary(ready),
+        'first_index_after_ready': summary(first_page),
+        'imports': {m: import_profile(m) for m in ('web', 'bot')}
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo', choices=['uri', 'mock'], default='uri')
+    parser.add_argument('--mongodb-uri', default=os.getenv('BENCH_MONGODB_URI', 'mongodb://127.0.0.1:27017'))
+    parser.add_argument('--db', default='tgbot_bench', help="database to drop and reseed")
+    parser.add_argument('--videos', type=int, default=100_000)
+    parser.add_argument('--thumbnails', type=int, default=2000, help="how many of the videos get a thumbnail file")
+    parser.add_argument('--users', type=int, default=1000, help="verified synthetic users sending /start")
+    parser.add_argument('--requests', type=int, default=2000, help="measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--outbound-rate', type=float, default=10000,
+                        help="global outbound messages/s; the default effectively disables the production cap")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="simulated Bot API round trip, in ms")
+    parser.add_argument('--cold-runs', type=int, default=5, help="fresh processes started by cold_start")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help="also write the JSON results here")
+    args = parser.parse_args()
+
+    selected = [s for s in args.scenarios.split(',') if s]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.mongo == 'mock' and 'search' in selected:
+        print("search skipped: mongomock has no $text support", file=sys.stderr)
+        selected.remove('search')
+
+    rng = random.Random(7)
+    api = start_fake_bot_api(args.api_latency / 1000)
+    configure(args, api.server_port)
+    seed_s = seed(args.videos, min(args.thumbnails, args.videos), args.users)
+    print(f"Seeded {args.videos} videos in {seed_s:.1f}s", file=sys.stderr)
+
+    results = {}
+    if 'cold_start' in selected:
+        results['cold_start'] = cold_start(args)
+    web_selected = [s for s in selected if s not in ('start', 'cold_start')]
+    if web_selected:
+        results.update(asyncio.run(run_web(args, start_web(), web_selected, rng)))
+    if 'start' in selected:
+        results['start'] = asyncio.run(run_start(args, rng))
+
+    report = {
+        'commit': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'mongodb_uri')},
+        'bot_api_calls': dict(FakeBotAPI.calls),
+        'results': results
+    }
+    for name, r in results.items():
+        if name == 'cold_start':
+            ready = r['healthz_ready'] or {}
+            print(f"{name:<12} /healthz ready p50={ready.get('p50_ms')}ms, import web="
+                  f"{r['imports']['web']['total_ms']}ms bot={r['imports']['bot']['total_ms']}ms", file=sys.stderr)
+            continue
+        print(f"{name:<12} {r['throughput_rps']:>9.1f}/s  p50={r['p50_ms']:.1f}ms p95={r['p95_ms']:.1f}ms "
+              f"p99={r['p99_ms']:.1f}ms errors={sum(r['errors'].values())}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
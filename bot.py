@@ -0,0 +1,992 @@
+import os
+import io
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import functools
+import multiprocessing
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import AutoReconnect
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, filters
+from telegram.request import HTTPXRequest
+from tenacity import retry, retry_if_exception, stop_after_attempt
+from config import (
+    BOT_TOKEN, ADMIN_ID, CHANNEL_ID, UPDATES_CHANNEL, CAPTCHA_URL, TUTORIAL_URL, LOG_CHANNEL,
+    VERIFY_INTERVAL, SELF_DESTRUCT, THUMBNAILS_DIR, EXTRACT_WORKERS, EXTRACT_HEAD_BYTES, EXTRACT_TIMEOUT,
+    INGEST_WORKERS, INGEST_BATCH, INGEST_FLUSH_INTERVAL, INGEST_RETRIES, INGEST_MAX_ATTEMPTS,
+    MIGRATE_CONCURRENCY, MIGRATE_RATE, MIGRATE_BATCH, ACCESS_CACHE_SIZE, MEMBERSHIP_TTL,
+    BACKFILL_CONCURRENCY, BACKFILL_BATCH, BACKFILL_CHAT, BACKFILL_RATE,
+    DELETE_BATCH, DELETE_CONCURRENCY, DELETE_RATE, DELETE_SWEEP_INTERVAL, STATS_INTERVAL,
+    CONCURRENT_UPDATES, LOG_DIGEST_INTERVAL, BOT_MODE, PUBLIC_URL, BOT_WEBHOOK_LISTEN, BOT_WEBHOOK_PORT, WEBHOOK_SECRET, BOT_API_URL, BOT_API_FILE_URL,
+    DEFAULT_CATEGORY, CATEGORIES, CATEGORY_CHANNELS, CHANNEL_FOR_CATEGORY
+)
+from store import (
+    videos, users, meta, ingest_jobs, deletions, run_db, db_metrics, LRUCache, video_cache,
+    get_video, record_videos, ensure_indexes, publish_metrics
+)
+from thumbnails import (
+    thumbnail_index, index_thumbnail, build_derivatives, backfill_derivatives, build_thumbnail_index,
+    extract_frame, thumbnail_stage_latency
+)
+from metrics import Counter, Histogram, Gauge, CounterFunc, startup_phase, mark_ready
+from outbound import OutboundScheduler, PRIORITY_ADMIN, PRIORITY_LOG, PRIORITY_BACKFILL
+
+logger = logging.getLogger(__name__)
+
+# Bot API calls by method and HTTP status (429s show up as status="429")
+telegram_requests = Counter('telegram_requests_total', "Bot API calls by method and status", ('method', 'status'))
+telegram_latency = Histogram('telegram_request_duration_seconds', "Bot API call latency by method", ('method',))
+
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, *args, **kwargs):
+        # File downloads carry the file path in the URL; keep them in one series
+        api_method = 'download_file' if url.startswith(BOT_API_FILE_URL) else url.rsplit('/', 1)[-1]
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, *args, **kwargs)
+            return status, payload
+        finally:
+            telegram_latency.observe(time.perf_counter() - started, method=api_method)
+            telegram_requests.inc(method=api_method, status=status)
+
+# Initialize Telegram bot; every outgoing message goes through one scheduler
+outbound = OutboundScheduler(chat_rates={BACKFILL_CHAT: BACKFILL_RATE})
+application = (
+    ApplicationBuilder()
+    .token(BOT_TOKEN)
+    .base_url(BOT_API_URL)
+    .base_file_url(BOT_API_FILE_URL)
+    .request(InstrumentedRequest(connection_pool_size=256))
+    .get_updates_request(InstrumentedRequest())
+    .rate_limiter(outbound)
+    .concurrent_updates(CONCURRENT_UPDATES)
+    .build()
+)
+
+# Frame extraction runs in worker processes; the semaphore bounds download + decode jobs in flight.
+# Workers import cv2 on their first job, so forking them early stays cheap
+def new_frame_pool():
+    return ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context('fork'))
+
+frame_pool = new_frame_pool()
+extract_slots = asyncio.Semaphore(EXTRACT_WORKERS)
+extract_metrics = {'jobs': 0, 'ok': 0, 'failed': 0, 'full_downloads': 0, 'recent': deque(maxlen=100)}
+http_client = httpx.AsyncClient(timeout=httpx.Timeout(30, read=120), follow_redirects=True)
+
+# Async utilities
+def single_flight(inflight, key, make_coro):
+    """Share one in-flight task between concurrent callers asking for the same key."""
+    task = inflight.get(key)
+    if not task:
+        task = inflight[key] = asyncio.ensure_future(make_coro())
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return asyncio.shield(task)
+
+# Access caches: positive membership for MEMBERSHIP_TTL, verification until its expiry
+membership_cache = LRUCache(ACCESS_CACHE_SIZE, MEMBERSHIP_TTL, 'membership')
+verified_cache = LRUCache(ACCESS_CACHE_SIZE, VERIFY_INTERVAL.total_seconds(), 'verified')
+membership_lookups = {}
+
+async def fetch_membership(bot, user_id):
+    try:
+        m = await bot.get_chat_member(UPDATES_CHANNEL, user_id)
+        is_member = m.status not in ['left', 'kicked']
+    except Exception as e:
+        logger.error(f"Error checking membership for user {user_id}: {e}")
+        return False
+    if is_member:
+        membership_cache.set(user_id, True)
+    return is_member
+
+async def check_membership(bot, user_id):
+    found, _ = membership_cache.get(user_id)
+    if found:
+        return True
+    return await single_flight(membership_lookups, user_id, lambda: fetch_membership(bot, user_id))
+
+async def is_verified(user_id):
+    now = datetime.utcnow()
+    found, expires = verified_cache.get(user_id)
+    if found and expires > now:
+        return True
+    rec = await run_db(users.find_one, {'user_id': user_id})
+    if not rec or 'last_verified' not in rec:
+        return False
+    expires = rec['last_verified'] + VERIFY_INTERVAL
+    if expires <= now:
+        return False
+    verified_cache.set(user_id, expires)
+    return True
+
+async def require_access(update: Update, context):
+    uid = update.effective_user.id
+    if not await check_membership(context.bot, uid):
+        btn = InlineKeyboardButton("Join Updates Channel", url=f"https://t.me/{UPDATES_CHANNEL.strip('@')}")
+        await update.message.reply_text("🚨 Please join the updates channel.", reply_markup=InlineKeyboardMarkup([[btn]]))
+        return False
+    if not await is_verified(uid):
+        btn1 = InlineKeyboardButton("Verify Human", url=CAPTCHA_URL)
+        btn2 = InlineKeyboardButton("How to Solve Captcha", url=TUTORIAL_URL)
+        await update.message.reply_text("🛡️ Please verify human to proceed.", reply_markup=InlineKeyboardMarkup([[btn1], [btn2]]))
+        return False
+    return True
+
+# Self-destruct: deadlines live in Mongo and one sweeper deletes whatever is due, in batches
+deletion_stats = {'deleted': 0, 'failed': 0, 'rate_limited': 0}
+CounterFunc('deletions_total', "Self-destruct deletions by outcome", ('outcome',),
+            lambda: {(k,): v for k, v in deletion_stats.items()})
+Gauge('deletions_pending', "Self-destruct deletions waiting in Mongo", collect=lambda: deletions.estimated_document_count())
+
+async def schedule_deletion(chat_id, message_id, delay=SELF_DESTRUCT):
+    await run_db(deletions.insert_one, {'chat_id': chat_id, 'message_id': message_id, 'due_at': datetime.utcnow() + delay})
+
+async def delete_message(bot, rec, limiter):
+    await limiter.wait()
+    try:
+        await bot.delete_message(chat_id=rec['chat_id'], message_id=rec['message_id'])
+        deletion_stats['deleted'] += 1
+    except RetryAfter as e:
+        # Leave it in the collection; the next sweep picks it up
+        deletion_stats['rate_limited'] += 1
+        await asyncio.sleep(e.retry_after)
+        return None
+    except Exception as e:
+        deletion_stats['failed'] += 1
+        logger.error(f"Error deleting message: {e}")
+    return rec['_id']
+
+async def deletion_sweeper(bot):
+    limiter = RateLimiter(DELETE_RATE)
+    while True:
+        try:
+            due = await run_db(lambda: list(deletions.find({'due_at': {'$lte': datetime.utcnow()}}).sort('due_at', ASCENDING).limit(DELETE_BATCH)))
+            if due:
+                slots = asyncio.Semaphore(DELETE_CONCURRENCY)
+                async def run(rec):
+                    async with slots:
+                        return await delete_message(bot, rec, limiter)
+                handled = [i for i in await asyncio.gather(*(run(rec) for rec in due)) if i]
+                await run_db(deletions.delete_many, {'_id': {'$in': handled}})
+                if len(due) == DELETE_BATCH:
+                    continue
+            await asyncio.sleep(DELETE_SWEEP_INTERVAL)
+        except Exception as e:
+            logger.error(f"Deletion sweep failed: {e}")
+            await asyncio.sleep(DELETE_SWEEP_INTERVAL)
+
+# Verification notices are coalesced into one LOG_CHANNEL digest per LOG_DIGEST_INTERVAL
+verification_log = []
+
+async def send_log_digest(bot):
+    if not verification_log:
+        return
+    uids = verification_log[:]
+    del verification_log[:]
+    # (text, uids in it) per message; Telegram caps messages at 4096 characters
+    chunks, text, chunk_uids = [], f"🔐 {len(uids)} users verified\n", []
+    for uid in uids:
+        line = f"• {uid}\n"
+        if len(text) + len(line) > 4096:
+            chunks.append((text, chunk_uids))
+            text, chunk_uids = '', []
+        text += line
+        chunk_uids.append(uid)
+    chunks.append((text, chunk_uids))
+    for i, (text, _) in enumerate(chunks):
+        try:
+            await bot.send_message(LOG_CHANNEL, text, rate_limit_args=PRIORITY_LOG)
+        except Exception:
+            # Only what wasn't sent goes back for the next digest
+            verification_log[:0] = [uid for _, unsent in chunks[i:] for uid in unsent]
+            raise
+
+async def log_digest_loop(bot):
+    while True:
+        await asyncio.sleep(LOG_DIGEST_INTERVAL)
+        try:
+            await send_log_digest(bot)
+        except Exception as e:
+            logger.error(f"Failed to send log digest: {e}")
+
+# Failures worth retrying with backoff. BadRequest is a NetworkError too, but retrying it ("file is too big") never helps
+TRANSIENT_ERRORS = (NetworkError, RetryAfter, AutoReconnect, httpx.TransportError)
+
+def is_transient(e):
+    return isinstance(e, TRANSIENT_ERRORS) and not isinstance(e, BadRequest)
+
+async def save_thumbnail(bot, file_id, key):
+    started = time.perf_counter()
+    try:
+        file = await bot.get_file(file_id)
+        buf = io.BytesIO()
+        await file.download_to_memory(out=buf)
+        buf.seek(0)
+        thumbnail_path = os.path.join(THUMBNAILS_DIR, f"{key}.jpg")
+        with open(thumbnail_path, 'wb') as f:
+            f.write(buf.read())
+        thumbnail_stage_latency.observe(time.perf_counter() - started, stage='telegram_thumbnail')
+        index_thumbnail(f"{key}.jpg")
+        await build_derivatives(key)
+        return f"static/thumbnails/{key}.jpg"
+    except Exception as e:
+        # Transient failures go to the caller's retry; anything else means no thumbnail
+        if is_transient(e):
+            raise
+        logger.error(f"Failed to save thumbnail for key {key}: {e}")
+        return None
+
+async def download_head(url, path, limit=None):
+    """Download the first `limit` bytes of `url` (or all of it) into `path`. Returns the byte count."""
+    headers = {'Range': f'bytes=0-{limit - 1}'} if limit else {}
+    written = 0
+    async with http_client.stream('GET', url, headers=headers) as r:
+        if r.status_code >= 400:
+            # Not raise_for_status(): its message carries the file URL, and with it the bot token
+            raise Exception(f"file download failed: HTTP {r.status_code}")
+        with open(path, 'wb') as f:
+            async for chunk in r.aiter_bytes():
+                f.write(chunk)
+                written += len(chunk)
+                if limit and written >= limit:
+                    break
+    return written
+
+def record_extract_metrics(**job):
+    extract_metrics['jobs'] += 1
+    extract_metrics['ok' if job['ok'] else 'failed'] += 1
+    if job.get('full_download'):
+        extract_metrics['full_downloads'] += 1
+    extract_metrics['recent'].append(job)
+    for stage in ('download', 'decode'):
+        thumbnail_stage_latency.observe(job[f'{stage}_s'], stage=stage)
+    logger.debug(f"Frame extraction {job}")
+
+def reset_frame_pool(pool, reason):
+    """Replace `pool` if it is still the current one, killing its workers rather than waiting on them."""
+    global frame_pool
+    if pool is not frame_pool:
+        return
+    logger.warning(f"Restarting frame workers: {reason}")
+    frame_pool = new_frame_pool()
+    # No public way to stop a busy worker before 3.14; a hung decode would otherwise hold its process forever
+    for proc in list((pool._processes or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def decode_frame(video_path, thumbnail_path, rerun=True):
+    # Timing out only abandons the await, and a crashed worker breaks the pool for every later job,
+    # so both get the pool rebuilt
+    pool = frame_pool
+    try:
+        return await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(pool, extract_frame, video_path, thumbnail_path),
+            EXTRACT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        reset_frame_pool(pool, f"decode took over {EXTRACT_TIMEOUT}s")
+        raise
+    except BrokenProcessPool:
+        if pool is frame_pool or not rerun:
+            reset_frame_pool(pool, "a worker died")
+            raise
+        # Another job's reset killed this worker under us
+        return await decode_frame(video_path, thumbnail_path, rerun=False)
+
+async def extract_thumbnail_from_video(bot, file_id, key):
+    thumbnail_path = os.path.join(THUMBNAILS_DIR, f"{key}.jpg")
+    job = {'key': key, 'ok': False, 'bytes': 0, 'full_download': False, 'download_s': 0.0, 'decode_s': 0.0}
+    started = time.monotonic()
+    video_path = None
+    async with extract_slots:
+        try:
+            file = await bot.get_file(file_id)
+            fd, video_path = tempfile.mkstemp(suffix='.mp4')
+            os.close(fd)
+            # Try the leading byte range first; fall back to the whole file (e.g. moov atom at the end)
+            attempts = [EXTRACT_HEAD_BYTES, None] if (file.file_size or 0) > EXTRACT_HEAD_BYTES else [None]
+            for limit in attempts:
+                t = time.monotonic()
+                job['bytes'] = await download_head(file.file_path, video_path, limit)
+                job['full_download'] = limit is None
+                job['download_s'] += time.monotonic() - t
+                t = time.monotonic()
+                ok = await decode_frame(video_path, thumbnail_path)
+                job['decode_s'] += time.monotonic() - t
+                if ok:
+                    break
+            else:
+                raise Exception("Could not read frame")
+            job['ok'] = True
+        except Exception as e:
+            if is_transient(e):
+                raise
+            logger.error(f"Failed to extract thumbnail for key {key}: {e}")
+        finally:
+            if video_path:
+                try:
+                    os.remove(video_path)
+                except OSError:
+                    pass
+            job['total_s'] = time.monotonic() - started
+            record_extract_metrics(**job)
+    if not job['ok']:
+        return None
+    index_thumbnail(f"{key}.jpg")
+    await build_derivatives(key)
+    return f"static/thumbnails/{key}.jpg"
+
+# Ingest queue: handlers enqueue jobs in Mongo, workers process them and write the catalog in batches
+ingest_wakeup = asyncio.Event()
+ingest_buffer = []
+ingest_done_times = deque(maxlen=10000)
+thumbnail_jobs = {}
+ingest_outcomes = Counter('ingest_jobs_processed_total', "Ingest jobs by outcome", ('outcome',))
+ingest_latency = Histogram('ingest_job_duration_seconds', "Time to build one catalog record, thumbnail included")
+Gauge('ingest_queue_depth', "Ingest jobs in Mongo by status", ('status',),
+      lambda: {(k,): v for k, v in ingest_stats().items() if k in ('pending', 'running', 'failed')})
+Gauge('ingest_buffered', "Catalog records waiting for the next batch write", collect=lambda: len(ingest_buffer))
+Gauge('thumbnail_fetches_in_flight', "Thumbnail downloads/extractions in progress", collect=lambda: len(thumbnail_jobs))
+
+def _retry_wait(state):
+    exc = state.outcome.exception()
+    if isinstance(exc, RetryAfter):
+        return exc.retry_after
+    return min(30, 2 ** state.attempt_number)
+
+transient_retry = retry(
+    retry=retry_if_exception(is_transient),
+    wait=_retry_wait,
+    stop=stop_after_attempt(INGEST_RETRIES),
+    reraise=True
+)
+
+def caption_category(caption):
+    # Admin uploads pick their catalog with a #tag, e.g. "#anime Episode 3"
+    for word in (caption or '').split():
+        if word.startswith('#') and word[1:].lower() in CATEGORIES:
+            return word[1:].lower(), ' '.join(caption.replace(word, '', 1).split()) or None
+    return None, caption
+
+def ingest_payload(source, msg, origin=None):
+    # `origin` is the (chat_id, message_id) of the original post when `msg` is a forwarded copy of it
+    chat_id, message_id = origin or (msg.chat.id, msg.message_id)
+    media = msg.video or msg.document
+    category, caption = caption_category(msg.caption)
+    if source == 'channel':
+        # The channel decides the catalog; the tag is stripped too, since admin forwards carry it
+        category = CATEGORY_CHANNELS[chat_id]
+    thumb = None
+    if msg.video:
+        thumb_attr = getattr(media, 'thumbnail', None) or getattr(media, 'thumb', None)
+        if thumb_attr:
+            thumb = thumb_attr[-1] if isinstance(thumb_attr, list) else thumb_attr
+    return {
+        'source': source,
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'file_id': media.file_id,
+        'file_unique_id': media.file_unique_id,
+        'thumb_file_id': thumb.file_id if thumb else None,
+        'is_video': bool(msg.video),
+        'caption': caption,
+        'category': category or DEFAULT_CATEGORY
+    }
+
+async def enqueue_ingest(payload):
+    now = datetime.utcnow()
+    await run_db(ingest_jobs.insert_one, {'payload': payload, 'status': 'pending', 'attempts': 0, 'created_at': now, 'run_at': now})
+    ingest_wakeup.set()
+
+def claim_ingest_job():
+    now = datetime.utcnow()
+    return ingest_jobs.find_one_and_update(
+        {'status': 'pending', 'run_at': {'$lte': now}},
+        {'$set': {'status': 'running', 'started_at': now}, '$inc': {'attempts': 1}},
+        sort=[('run_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+@transient_retry
+async def forward_to_channel(bot, payload):
+    channel = CHANNEL_FOR_CATEGORY.get(payload.get('category'), CHANNEL_ID)
+    return await bot.forward_message(channel, payload['chat_id'], payload['message_id'], rate_limit_args=PRIORITY_ADMIN)
+
+@transient_retry
+async def insert_catalog_batch(docs):
+    await run_db(record_videos, docs)
+
+@transient_retry
+async def fetch_thumbnail(bot, payload, key):
+    if payload['thumb_file_id']:
+        return await save_thumbnail(bot, payload['thumb_file_id'], key)
+    return await extract_thumbnail_from_video(bot, payload['file_id'], key)
+
+async def ensure_thumbnail(bot, payload, key, refresh=False):
+    # Concurrent duplicates of the same file share one download/extraction; `refresh` rebuilds an existing one
+    if not refresh and f"{key}.jpg" in thumbnail_index:
+        return f"static/thumbnails/{key}.jpg"
+    return await single_flight(thumbnail_jobs, key, lambda: fetch_thumbnail(bot, payload, key))
+
+async def process_ingest(bot, payload, refresh=False):
+    """Build the catalog record for a job, or return None if the file is already catalogued.
+
+    With `refresh` the record and its thumbnail are rebuilt even if the file is already catalogued.
+    """
+    key = f"file_{payload['file_unique_id']}"
+    existing = await run_db(get_video, key)
+    if existing and not refresh and (existing.get('thumbnail_path') or existing['type'] != 'video'):
+        return None
+    thumbnail_path = None
+    if payload['is_video']:
+        thumbnail_path = await ensure_thumbnail(bot, payload, key, refresh)
+    file_id, is_video = payload['file_id'], payload['is_video']
+    if payload['source'] == 'admin' and not existing:
+        sent = await forward_to_channel(bot, payload)
+        file_id, is_video = (sent.video or sent.document).file_id, bool(sent.video)
+    return {
+        'file_id': file_id,
+        'custom_key': key,
+        'title': payload['caption'] or 'Untitled',
+        'thumbnail_url': f"/thumbnails/{key}.jpg",
+        'thumbnail_path': thumbnail_path,
+        'type': 'video' if is_video else 'document',
+        'category': payload.get('category', DEFAULT_CATEGORY)
+    }
+
+def fail_ingest_job(job, error):
+    if job['attempts'] < INGEST_MAX_ATTEMPTS:
+        update = {'status': 'pending', 'run_at': datetime.utcnow() + timedelta(seconds=30 * job['attempts'])}
+    else:
+        update = {'status': 'failed', 'finished_at': datetime.utcnow()}
+    ingest_jobs.update_one({'_id': job['_id']}, {'$set': {**update, 'error': str(error)}})
+
+def finish_ingest_jobs(ids):
+    ingest_jobs.update_many({'_id': {'$in': ids}}, {'$set': {'status': 'done', 'finished_at': datetime.utcnow()}})
+
+async def flush_ingest(bot):
+    if not ingest_buffer:
+        return
+    batch = ingest_buffer[:]
+    del ingest_buffer[:]
+    try:
+        await insert_catalog_batch([doc for _, doc in batch])
+    except Exception as e:
+        logger.error(f"Failed to write ingest batch of {len(batch)}: {e}")
+        for job, _ in batch:
+            await run_db(fail_ingest_job, job, e)
+        ingest_outcomes.inc(len(batch), outcome='failed')
+        return
+    await run_db(finish_ingest_jobs, [job['_id'] for job, _ in batch])
+    ingest_outcomes.inc(len(batch), outcome='saved')
+    now = time.monotonic()
+    ingest_done_times.extend([now] * len(batch))
+    for job, doc in batch:
+        if job['payload']['source'] == 'admin':
+            await bot.send_message(ADMIN_ID, f"✅ Saved {doc['custom_key']}", rate_limit_args=PRIORITY_ADMIN)
+
+async def ingest_next(bot):
+    job = await run_db(claim_ingest_job)
+    if not job:
+        ingest_wakeup.clear()
+        try:
+            await asyncio.wait_for(ingest_wakeup.wait(), INGEST_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        return
+    try:
+        with ingest_latency.timer():
+            doc = await process_ingest(bot, job['payload'])
+    except Exception as e:
+        logger.error(f"Ingest job {job['_id']} failed (attempt {job['attempts']}): {e}")
+        await run_db(fail_ingest_job, job, e)
+        ingest_outcomes.inc(outcome='failed')
+        return
+    if doc is None:
+        await run_db(finish_ingest_jobs, [job['_id']])
+        ingest_outcomes.inc(outcome='duplicate')
+        if job['payload']['source'] == 'admin':
+            await bot.send_message(
+                ADMIN_ID, f"♻️ Already saved file_{job['payload']['file_unique_id']}", rate_limit_args=PRIORITY_ADMIN
+            )
+        return
+    ingest_buffer.append((job, doc))
+    if len(ingest_buffer) >= INGEST_BATCH:
+        await flush_ingest(bot)
+
+async def ingest_worker(bot):
+    while True:
+        try:
+            await ingest_next(bot)
+        except Exception as e:
+            # A job caught mid-way stays running until the next start requeues it; the worker carries on
+            logger.error(f"Ingest worker error: {e}")
+            await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+
+async def ingest_flusher(bot):
+    while True:
+        await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+        try:
+            await flush_ingest(bot)
+        except Exception as e:
+            logger.error(f"Ingest flush failed: {e}")
+
+async def start_ingest_workers(app):
+    # Jobs left running by a previous process never finished
+    await run_db(ingest_jobs.update_many, {'status': 'running'}, {'$set': {'status': 'pending'}})
+    for _ in range(INGEST_WORKERS):
+        app.create_task(ingest_worker(app.bot))
+    app.create_task(ingest_flusher(app.bot))
+
+async def start_background_tasks(app):
+    mark_ready('bot')
+    await start_ingest_workers(app)
+    app.create_task(run_background_migrations(app.bot))
+    app.create_task(monitor_loop_lag())
+    app.create_task(deletion_sweeper(app.bot))
+    app.create_task(log_digest_loop(app.bot))
+    app.create_task(publish_bot_stats())
+
+def ingest_stats():
+    counts = {d['_id']: d['n'] for d in ingest_jobs.aggregate([
+        {'$match': {'status': {'$in': ['pending', 'running', 'failed']}}},
+        {'$group': {'_id': '$status', 'n': {'$sum': 1}}}
+    ])}
+    now = time.monotonic()
+    return {
+        'pending': counts.get('pending', 0),
+        'running': counts.get('running', 0),
+        'failed': counts.get('failed', 0),
+        'buffered': len(ingest_buffer),
+        'done_last_min': sum(1 for t in ingest_done_times if now - t < 60),
+        'done_last_5min': sum(1 for t in ingest_done_times if now - t < 300)
+    }
+
+handler_latency = Histogram('bot_handler_duration_seconds', "PTB handler latency", ('handler',))
+handler_errors = Counter('bot_handler_errors_total', "PTB handlers that raised", ('handler',))
+
+def instrumented(handler):
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            handler_errors.inc(handler=handler.__name__)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, handler=handler.__name__)
+    return wrapper
+
+def register_handlers():
+    @instrumented
+    async def handle_media(update: Update, context):
+        user = update.effective_user
+        if not user or user.id != ADMIN_ID:
+            return
+        msg = update.message
+        if not (msg.video or msg.document):
+            return
+        await enqueue_ingest(ingest_payload('admin', msg))
+
+    @instrumented
+    async def channel_media(update: Update, context):
+        post = update.channel_post
+        if not post or post.chat.id not in CATEGORY_CHANNELS:
+            return
+        await enqueue_ingest(ingest_payload('channel', post))
+
+    @instrumented
+    async def queue_command(update: Update, context):
+        if update.effective_user.id != ADMIN_ID:
+            return
+        st = await run_db(ingest_stats)
+        await update.message.reply_text(
+            f"📥 Ingest queue\n"
+            f"Pending: {st['pending']}\nRunning: {st['running']}\nFailed: {st['failed']}\nBuffered: {st['buffered']}\n"
+            f"Done: {st['done_last_min']}/min, {st['done_last_5min']}/5min"
+        )
+
+    @instrumented
+    async def backfill_command(update: Update, context):
+        # /backfill FIRST LAST [refresh] [category], /backfill resume, or /backfill for progress
+        if update.effective_user.id != ADMIN_ID:
+            return
+        args = context.args
+        if not args:
+            await update.message.reply_text(backfill_summary(backfill_progress))
+            return
+        if backfill_progress['state'] == 'running':
+            await update.message.reply_text("⏳ A backfill is already running")
+            return
+        if args[0] == 'resume':
+            kwargs = {}
+        else:
+            options = {a.lower() for a in args[2:]}
+            category = next((c for c in CATEGORIES if c in options), DEFAULT_CATEGORY)
+            try:
+                kwargs = dict(first=int(args[0]), last=int(args[1]), channel_id=CHANNEL_FOR_CATEGORY[category], refresh='refresh' in options)
+            except (ValueError, IndexError):
+                await update.message.reply_text("Usage: /backfill FIRST LAST [refresh] [category], or /backfill resume")
+                return
+        # Mark it running now so a second command can't start another before the task does
+        backfill_progress['state'] = 'running'
+        context.application.create_task(backfill_task(context.bot, **kwargs))
+        await update.message.reply_text("📚 Backfill started; send /backfill for progress")
+
+    @instrumented
+    async def start_command(update: Update, context):
+        args = context.args
+        uid = update.effective_user.id
+        if args and args[0] == 'verified':
+            now = datetime.utcnow()
+            await run_db(users.update_one, {'user_id': uid}, {'$set': {'last_verified': now}}, upsert=True)
+            verified_cache.set(uid, now + VERIFY_INTERVAL)
+            verification_log.append(uid)
+            await update.message.reply_text("✅ Verified for 2 hours")
+            return
+        if not await require_access(update, context):
+            return
+        if not args:
+            btn = InlineKeyboardButton("How to Use", url=TUTORIAL_URL)
+            await update.message.reply_text("👋 Welcome!", reply_markup=InlineKeyboardMarkup([[btn]]))
+            return
+        key = args[0]
+        rec = await run_db(get_video, key)
+        if not rec:
+            await update.message.reply_text("❌ Media not found.")
+            return
+        send_fn = context.bot.send_video if rec['type'] == 'video' else context.bot.send_document
+        sent = await send_fn(update.effective_chat.id, rec['file_id'], caption=rec['title'], protect_content=True)
+        await schedule_deletion(update.effective_chat.id, sent.message_id)
+
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & (filters.VIDEO | filters.Document.ALL), handle_media))
+    application.add_handler(MessageHandler(filters.Chat(list(CATEGORY_CHANNELS)) & (filters.VIDEO | filters.Document.ALL), channel_media))
+    application.add_handler(CommandHandler('start', start_command))
+    application.add_handler(CommandHandler('queue', queue_command))
+    application.add_handler(CommandHandler('backfill', backfill_command))
+
+# Paces calls to at most `rate` per second across concurrent callers
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# Migrate legacy thumbnails in the background, checkpointing the last _id in meta so restarts resume
+migration_progress = {'state': 'idle'}
+
+async def migrate_one_thumbnail(bot, rec, slots, limiter):
+    key = rec['custom_key']
+    async with slots:
+        for attempt in range(3):
+            try:
+                if f"{key}.jpg" in thumbnail_index:
+                    thumbnail_path = f"static/thumbnails/{key}.jpg"
+                else:
+                    await limiter.wait()
+                    thumbnail_path = await save_thumbnail(bot, rec['thumbnail_file_id'], key)
+                break
+            except RetryAfter as e:
+                logger.warning(f"Rate limited while migrating {key}, sleeping {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TRANSIENT_ERRORS as e:
+                logger.warning(f"Transient error migrating {key} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+        else:
+            thumbnail_path = None
+    if not thumbnail_path:
+        logger.warning(f"Failed to migrate thumbnail for key: {key}")
+        return False
+    await run_db(videos.update_one, {'_id': rec['_id']}, {'$set': {'thumbnail_path': thumbnail_path}})
+    video_cache.pop(key)
+    return True
+
+async def migrate_thumbnails(bot):
+    query = {'thumbnail_path': None, 'thumbnail_file_id': {'$exists': True}}
+    checkpoint = await run_db(meta.find_one, {'_id': 'thumbnail_migration'}) or {}
+    last_id = checkpoint.get('last_id')
+    total = await run_db(videos.count_documents, {**query, '_id': {'$gt': last_id}} if last_id else query)
+    if not total:
+        await run_db(meta.delete_one, {'_id': 'thumbnail_migration'})
+        migration_progress.update(state='done', total=0)
+        return
+    started = time.monotonic()
+    migration_progress.update(state='running', total=total, done=0, migrated=0, failed=0, eta_s=None)
+    logger.info(f"Migrating {total} legacy thumbnails" + (f", resuming after {last_id}" if last_id else ""))
+    slots = asyncio.Semaphore(MIGRATE_CONCURRENCY)
+    limiter = RateLimiter(MIGRATE_RATE)
+    while True:
+        page_query = {**query, '_id': {'$gt': last_id}} if last_id else query
+        page = await run_db(lambda: list(videos.find(page_query, {'custom_key': 1, 'thumbnail_file_id': 1}).sort('_id', ASCENDING).limit(MIGRATE_BATCH)))
+        if not page:
+            break
+        results = await asyncio.gather(*(migrate_one_thumbnail(bot, rec, slots, limiter) for rec in page))
+        last_id = page[-1]['_id']
+        await run_db(meta.update_one, {'_id': 'thumbnail_migration'}, {'$set': {'last_id': last_id, 'updated_at': datetime.utcnow()}}, upsert=True)
+        done = migration_progress['done'] + len(page)
+        rate = done / (time.monotonic() - started)
+        migration_progress.update(
+            done=done,
+            migrated=migration_progress['migrated'] + sum(results),
+            failed=migration_progress['failed'] + len(results) - sum(results),
+            rate=round(rate, 2),
+            eta_s=round(max(total - done, 0) / rate) if rate else None
+        )
+        logger.info(f"Thumbnail migration {done}/{total}, {rate:.1f}/s, ETA {migration_progress['eta_s']}s")
+    # Pass complete: clear the checkpoint so the next start retries whatever failed
+    await run_db(meta.delete_one, {'_id': 'thumbnail_migration'})
+    migration_progress['state'] = 'done'
+
+async def run_background_migrations(bot):
+    try:
+        await migrate_thumbnails(bot)
+    except Exception as e:
+        migration_progress['state'] = 'error'
+        logger.error(f"Thumbnail migration stopped: {e}")
+    await backfill_derivatives()
+
+# Channel backfill: the Bot API can't fetch a message by id, so each post in the range is forwarded to
+# BACKFILL_CHAT and read from the copy. Records are upserted one window at a time and the next message id
+# is checkpointed in meta, so an interrupted run resumes where it stopped.
+backfill_progress = {'state': 'idle'}
+backfill_outcomes = Counter('backfill_messages_total', "Channel backfill results by outcome", ('outcome',))
+BACKFILL_OUTCOMES = ('saved', 'skipped', 'missing', 'not_media', 'failed')
+# What Telegram says about ids with no post behind them; other BadRequests (a wrong BACKFILL_CHAT, protected posts) are failures
+MISSING_POST_ERRORS = ('message to forward not found', 'message_id_invalid')
+
+@transient_retry
+async def read_channel_post(bot, channel_id, message_id):
+    """Return a forwarded copy of the post, or None if it doesn't exist (deleted, or a service message)."""
+    try:
+        copy = await bot.forward_message(
+            BACKFILL_CHAT, channel_id, message_id, disable_notification=True, rate_limit_args=PRIORITY_BACKFILL
+        )
+    except BadRequest as e:
+        if any(m in e.message.lower() for m in MISSING_POST_ERRORS):
+            return None
+        raise
+    await schedule_deletion(BACKFILL_CHAT, copy.message_id, delay=timedelta(0))
+    return copy
+
+async def backfill_one(bot, channel_id, message_id, refresh, slots):
+    async with slots:
+        try:
+            post = await read_channel_post(bot, channel_id, message_id)
+            if post is None:
+                return 'missing', None
+            if not (post.video or post.document):
+                return 'not_media', None
+            payload = ingest_payload('channel', post, origin=(channel_id, message_id))
+            doc = await process_ingest(bot, payload, refresh=refresh)
+        except Exception as e:
+            logger.error(f"Backfill of message {message_id} in {channel_id} failed: {e}")
+            return 'failed', None
+    return ('saved', doc) if doc else ('skipped', None)
+
+def backfill_windows(retry_ids, first, last):
+    """Yield (message ids, next_id to checkpoint after them): earlier failures first, then the range."""
+    for i in range(0, len(retry_ids), BACKFILL_BATCH):
+        yield retry_ids[i:i + BACKFILL_BATCH], first
+    for start in range(first, last + 1, BACKFILL_BATCH):
+        window = range(start, min(start + BACKFILL_BATCH, last + 1))
+        yield window, window.stop
+
+async def run_backfill(bot, first=None, last=None, channel_id=CHANNEL_ID, refresh=False):
+    """Index channel posts `first`..`last`, or resume the checkpointed run if no range is given.
+
+    Posts that fail are kept in the checkpoint, so `resume` retries them even after the range is done.
+    """
+    retry_ids, first_id = [], first
+    if first is None:
+        checkpoint = await run_db(meta.find_one, {'_id': 'channel_backfill'})
+        if not checkpoint:
+            raise ValueError("No backfill to resume")
+        first, last = checkpoint['next_id'], checkpoint['last_id']
+        channel_id, refresh = checkpoint['channel_id'], checkpoint['refresh']
+        retry_ids, first_id = checkpoint.get('failed_ids', []), checkpoint.get('first_id', first)
+    if channel_id not in CATEGORY_CHANNELS:
+        raise ValueError(f"{channel_id} is not a storage channel")
+    total = len(retry_ids) + max(last - first + 1, 0)
+    started = time.monotonic()
+    backfill_progress.clear()
+    backfill_progress.update(
+        state='running', channel_id=channel_id, first=first_id, last=last, refresh=refresh, total=total, done=0,
+        rate=None, eta_s=None, **{outcome: 0 for outcome in BACKFILL_OUTCOMES}
+    )
+    logger.info(f"Backfilling messages {first}-{last} of {channel_id}" + (" (refresh)" if refresh else ""))
+    slots = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    pending, failed = list(retry_ids), []
+    try:
+        for window, next_id in backfill_windows(retry_ids, first, last):
+            results = await asyncio.gather(*(backfill_one(bot, channel_id, m, refresh, slots) for m in window))
+            if all(outcome == 'failed' for outcome, _ in results):
+                # Nothing in the window worked: more likely BACKFILL_CHAT or the bot's rights than the posts
+                raise RuntimeError(f"Every post in {window[0]}-{window[-1]} failed; check BACKFILL_CHAT and the bot's channel rights")
+            docs = [doc for _, doc in results if doc]
+            if docs:
+                await insert_catalog_batch(docs)
+            pending = [m for m in pending if m not in window]
+            failed += [m for m, (outcome, _) in zip(window, results) if outcome == 'failed']
+            await run_db(meta.update_one, {'_id': 'channel_backfill'}, {'$set': {
+                'channel_id': channel_id, 'first_id': first_id, 'next_id': next_id, 'last_id': last, 'refresh': refresh,
+                'failed_ids': pending + failed, 'updated_at': datetime.utcnow()
+            }}, upsert=True)
+            for outcome, _ in results:
+                backfill_progress[outcome] += 1
+                backfill_outcomes.inc(outcome=outcome)
+            done = backfill_progress['done'] + len(window)
+            rate = done / (time.monotonic() - started)
+            backfill_progress.update(
+                done=done, rate=round(rate, 2), eta_s=round(max(total - done, 0) / rate) if rate else None
+            )
+            logger.info(f"Backfill {done}/{total}, {backfill_progress['saved']} saved, {rate:.1f} msg/s, ETA {backfill_progress['eta_s']}s")
+    except Exception:
+        backfill_progress['state'] = 'error'
+        raise
+    if failed:
+        logger.warning(f"Backfill left {len(failed)} failed posts; resume retries them")
+    else:
+        await run_db(meta.delete_one, {'_id': 'channel_backfill'})
+    backfill_progress['state'] = 'done'
+    return backfill_progress
+
+def backfill_summary(progress):
+    if 'total' not in progress:
+        return "No backfill has run since the bot started"
+    return (
+        f"📚 Backfill {progress['state']}: {progress['done']}/{progress['total']} messages "
+        f"({progress['first']}–{progress['last']} of {progress['channel_id']})\n"
+        f"Saved: {progress['saved']}\nSkipped: {progress['skipped']}\nMissing: {progress['missing']}\n"
+        f"Not media: {progress['not_media']}\nFailed: {progress['failed']}"
+        f"{' (resume retries them)' if progress['failed'] and progress['state'] == 'done' else ''}\n"
+        f"Rate: {progress['rate']} msg/s, ETA {progress['eta_s']}s"
+    )
+
+async def backfill_task(bot, **kwargs):
+    try:
+        await run_backfill(bot, **kwargs)
+    except Exception as e:
+        backfill_progress['state'] = 'error'
+        logger.error(f"Backfill stopped: {e}")
+        await bot.send_message(ADMIN_ID, f"❌ Backfill stopped: {e}", rate_limit_args=PRIORITY_ADMIN)
+        return
+    await bot.send_message(ADMIN_ID, backfill_summary(backfill_progress), rate_limit_args=PRIORITY_ADMIN)
+
+def backfill_main(argv):
+    parser = argparse.ArgumentParser(prog='app.py backfill', description="Index a range of storage channel posts")
+    parser.add_argument('first', help="first message id, or 'resume' to continue the checkpointed run")
+    parser.add_argument('last', type=int, nargs='?', help="last message id")
+    parser.add_argument('--category', choices=sorted(CATEGORIES), default=DEFAULT_CATEGORY, help="whose storage channel to read")
+    parser.add_argument('--refresh', action='store_true', help="rebuild records and thumbnails that are already complete")
+    args = parser.parse_args(argv)
+    if args.first == 'resume':
+        kwargs = {}
+    elif args.first.isdigit() and args.last is not None:
+        kwargs = dict(first=int(args.first), last=args.last, channel_id=CHANNEL_FOR_CATEGORY[args.category], refresh=args.refresh)
+    else:
+        parser.error("give FIRST LAST, or 'resume'")
+
+    start_frame_workers()
+    ensure_indexes()
+    build_thumbnail_index()
+
+    async def main():
+        async with application.bot:
+            await run_backfill(application.bot, **kwargs)
+    try:
+        asyncio.run(main())
+    except ValueError as e:
+        parser.error(str(e))
+    print(backfill_summary(backfill_progress))
+
+# Bot loop health
+loop_lag = {'samples': 0, 'max_s': 0.0, 'last_s': 0.0}
+loop_lag_latency = Histogram('event_loop_lag_seconds', "How late the bot's event loop runs a 0.5s timer")
+
+async def monitor_loop_lag(interval=0.5):
+    # How late the loop wakes us up is how long something blocked it
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - started - interval
+        loop_lag_latency.observe(max(lag, 0.0))
+        loop_lag['samples'] += 1
+        loop_lag['last_s'] = round(lag, 4)
+        loop_lag['max_s'] = round(max(loop_lag['max_s'], lag), 4)
+
+def bot_stats():
+    return {
+        'membership_cache': membership_cache.stats(),
+        'verified_cache': verified_cache.stats(),
+        'thumbnail_extraction': {**extract_metrics, 'recent': list(extract_metrics['recent'])[-10:]},
+        'ingest': ingest_stats(),
+        'thumbnail_migration': migration_progress,
+        'backfill': backfill_progress,
+        'db': db_metrics,
+        'loop_lag': loop_lag,
+        'deletions': {**deletion_stats, 'pending': deletions.estimated_document_count()},
+        'outbound': {'queued': outbound.queued(), 'chats': len(outbound.chat_buckets), 'log_backlog': len(verification_log)},
+        'updated_at': datetime.utcnow()
+    }
+
+async def publish_bot_stats():
+    # The web tier runs in other processes, so share our counters through Mongo
+    while True:
+        try:
+            stats = await run_db(bot_stats)
+            await run_db(meta.replace_one, {'_id': 'bot_stats'}, stats, upsert=True)
+            await run_db(publish_metrics)
+        except Exception as e:
+            logger.error(f"Failed to publish bot stats: {e}")
+        await asyncio.sleep(STATS_INTERVAL)
+
+def start_frame_workers():
+    # Fork the frame workers before Flask, PTB or the thumbnail indexer start any threads
+    with startup_phase('frame_workers'):
+        frame_pool.submit(os.getpid).result()
+
+def prepare():
+    with startup_phase('ensure_indexes'):
+        ensure_indexes()
+    build_thumbnail_index()
+    register_handlers()
+    application.post_init = start_background_tasks
+
+def serve():
+    if BOT_MODE == 'webhook':
+        # Only the web tier is exposed; it relays Telegram's posts to this listener (loopback unless BOT_WEBHOOK_LISTEN is set)
+        application.run_webhook(
+            listen=BOT_WEBHOOK_LISTEN,
+            port=BOT_WEBHOOK_PORT,
+            url_path='telegram',
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=f"{PUBLIC_URL.rstrip('/')}/telegram/{WEBHOOK_SECRET}"
+        )
+    else:
+        application.run_polling()
+
+def run():
+    start_frame_workers()
+    prepare()
+    serve()
+
+if __name__ == '__main__':
+    run()
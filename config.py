@@ -0,0 +1,108 @@
+import os
+import hashlib
+import logging
+from datetime import timedelta
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# httpx logs every Bot API call and webhook relay at INFO; /metrics counts those instead
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Load environment variables
+load_dotenv()
+BOT_TOKEN        = os.getenv('BOT_TOKEN')
+MONGODB_URI      = os.getenv('MONGODB_URI')
+DB_NAME          = os.getenv('DB_NAME')
+ADMIN_ID         = int(os.getenv('ADMIN_ID'))
+CHANNEL_ID       = int(os.getenv('CHANNEL_ID'))
+UPDATES_CHANNEL  = os.getenv('UPDATES_CHANNEL')
+CAPTCHA_URL      = os.getenv('CAPTCHA_URL')
+TUTORIAL_URL     = os.getenv('TUTORIAL_URL')
+LOG_CHANNEL      = os.getenv('LOG_CHANNEL')
+BOT_USERNAME     = os.getenv('BOT_USERNAME')
+# Point these at a local Bot API server (or the benchmark's stand-in) instead of api.telegram.org
+BOT_API_URL      = os.getenv('BOT_API_URL', 'https://api.telegram.org/bot')
+BOT_API_FILE_URL = os.getenv('BOT_API_FILE_URL', 'https://api.telegram.org/file/bot')
+PORT             = int(os.getenv('PORT', 5000))
+APP_ROLE         = os.getenv('APP_ROLE', 'all')
+VERIFY_INTERVAL  = timedelta(hours=2)
+SELF_DESTRUCT    = timedelta(hours=1)
+PAGE_SIZE        = int(os.getenv('PAGE_SIZE', 24))
+MAX_PAGE_SIZE    = int(os.getenv('MAX_PAGE_SIZE', 100))
+VIDEO_CACHE_SIZE = int(os.getenv('VIDEO_CACHE_SIZE', 10000))
+VIDEO_CACHE_TTL  = int(os.getenv('VIDEO_CACHE_TTL', 300))
+VERSION_POLL     = float(os.getenv('VERSION_POLL', 5))
+THUMB_MISS_TTL   = int(os.getenv('THUMB_MISS_TTL', 60))
+THUMB_MAX_AGE    = 31536000
+THUMB_RECHECK_INTERVAL = float(os.getenv('THUMB_RECHECK_INTERVAL', 60))
+EXTRACT_WORKERS  = int(os.getenv('EXTRACT_WORKERS', 2))
+EXTRACT_HEAD_BYTES = int(os.getenv('EXTRACT_HEAD_BYTES', 4 * 1024 * 1024))
+EXTRACT_TIMEOUT  = float(os.getenv('EXTRACT_TIMEOUT', 60))
+INGEST_WORKERS   = int(os.getenv('INGEST_WORKERS', 4))
+INGEST_BATCH     = int(os.getenv('INGEST_BATCH', 20))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 2))
+INGEST_RETRIES   = int(os.getenv('INGEST_RETRIES', 5))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', 3))
+MIGRATE_CONCURRENCY = int(os.getenv('MIGRATE_CONCURRENCY', 4))
+MIGRATE_RATE     = float(os.getenv('MIGRATE_RATE', 10))
+MIGRATE_BATCH    = int(os.getenv('MIGRATE_BATCH', 100))
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', 4))
+BACKFILL_BATCH   = int(os.getenv('BACKFILL_BATCH', 50))
+# Backfill reads channel posts by forwarding them here (then deletes the copies); defaults to the admin's chat.
+# Forwards are paced at BACKFILL_RATE per second, so that is the backfill's throughput (~3600 posts/hour by default);
+# BACKFILL_CONCURRENCY only overlaps thumbnail work. A dedicated scratch chat keeps the copies out of the admin's way
+BACKFILL_CHAT    = int(os.getenv('BACKFILL_CHAT') or ADMIN_ID)
+BACKFILL_RATE    = float(os.getenv('BACKFILL_RATE', 1))
+MONGO_WEB_POOL   = int(os.getenv('MONGO_WEB_POOL', 20))
+MONGO_BOT_POOL   = int(os.getenv('MONGO_BOT_POOL', 8))
+ACCESS_CACHE_SIZE = int(os.getenv('ACCESS_CACHE_SIZE', 50000))
+DELETE_BATCH     = int(os.getenv('DELETE_BATCH', 200))
+DELETE_CONCURRENCY = int(os.getenv('DELETE_CONCURRENCY', 10))
+DELETE_RATE      = float(os.getenv('DELETE_RATE', 20))
+DELETE_SWEEP_INTERVAL = float(os.getenv('DELETE_SWEEP_INTERVAL', 5))
+MEMBERSHIP_TTL   = int(os.getenv('MEMBERSHIP_TTL', 300))
+STATS_INTERVAL   = float(os.getenv('STATS_INTERVAL', 10))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 32))
+PAGE_CACHE_SIZE  = int(os.getenv('PAGE_CACHE_SIZE', 512))
+PAGE_CACHE_TTL   = int(os.getenv('PAGE_CACHE_TTL', 3600))
+
+# Outbound Bot API pacing (Telegram allows ~30 msg/s overall, ~1/s per private chat, 20/min per group)
+OUTBOUND_RATE    = float(os.getenv('OUTBOUND_RATE', 25))
+OUTBOUND_PRIVATE_RATE = float(os.getenv('OUTBOUND_PRIVATE_RATE', 1))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60))
+OUTBOUND_DELETE_RATE = float(os.getenv('OUTBOUND_DELETE_RATE', 5))
+OUTBOUND_BURST   = int(os.getenv('OUTBOUND_BURST', 3))
+OUTBOUND_RETRIES = int(os.getenv('OUTBOUND_RETRIES', 3))
+LOG_DIGEST_INTERVAL = float(os.getenv('LOG_DIGEST_INTERVAL', 60))
+
+# Update delivery: 'polling' or 'webhook'. In webhook mode Telegram posts to PUBLIC_URL/telegram/<secret>
+# on the web tier, which relays to the bot's listener on BOT_WEBHOOK_PORT. The listener is loopback-only
+# unless BOT_WEBHOOK_LISTEN says otherwise; a web tier on another host sets BOT_WEBHOOK_RELAY to reach it
+BOT_MODE         = os.getenv('BOT_MODE', 'polling')
+PUBLIC_URL       = os.getenv('PUBLIC_URL', '')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', 8081))
+BOT_WEBHOOK_LISTEN = os.getenv('BOT_WEBHOOK_LISTEN', '127.0.0.1')
+BOT_WEBHOOK_RELAY = os.getenv('BOT_WEBHOOK_RELAY') or f"http://127.0.0.1:{BOT_WEBHOOK_PORT}"
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+# Only the bot registers the webhook; a web-only process just relays
+if BOT_MODE == 'webhook' and APP_ROLE != 'web' and not PUBLIC_URL.startswith('https://'):
+    raise ValueError(f"BOT_MODE=webhook needs PUBLIC_URL set to the site's https:// address, got {PUBLIC_URL!r}")
+# Derived from the token by default so the web and bot processes agree without extra config
+WEBHOOK_SECRET   = os.getenv('WEBHOOK_SECRET') or hashlib.sha256((BOT_TOKEN or '').encode()).hexdigest()[:32]
+DEFAULT_CATEGORY = os.getenv('DEFAULT_CATEGORY', 'movies')
+ANIME_CHANNEL_ID = os.getenv('ANIME_CHANNEL_ID')
+ADULT_CHANNEL_ID = os.getenv('ADULT_CHANNEL_ID')
+
+# Each catalog is fed by its own storage channel; CHANNEL_ID carries the default one
+CATEGORY_CHANNELS = {CHANNEL_ID: DEFAULT_CATEGORY}
+if ANIME_CHANNEL_ID:
+    CATEGORY_CHANNELS[int(ANIME_CHANNEL_ID)] = 'anime'
+if ADULT_CHANNEL_ID:
+    CATEGORY_CHANNELS[int(ADULT_CHANNEL_ID)] = 'adult'
+CHANNEL_FOR_CATEGORY = {category: chat_id for chat_id, category in CATEGORY_CHANNELS.items()}
+CATEGORIES = frozenset(CHANNEL_FOR_CATEGORY)
+CATEGORY_TEMPLATES = {'anime': 'anime.html', 'adult': 'adult.html'}
+
+THUMBNAILS_DIR = os.getenv('THUMBNAILS_DIR') or os.path.join('static', 'thumbnails')
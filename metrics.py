@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from config import APP_ROLE
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text-format metrics. Every process keeps its own registry; the bot and the other
+# gunicorn workers publish snapshots to Mongo and whichever web worker is scraped merges them.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+registry = []
+
+def process_name():
+    return f"{APP_ROLE}-{os.getpid()}"
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def family(self):
+        return {'name': self.name, 'type': self.type, 'help': self.help, 'samples': self.samples()}
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [[self.name, dict(zip(self.labelnames, k)), v] for k, v in self._values.items()]
+
+class Gauge(Metric):
+    """A gauge read at collection time from `collect()`: a number, or {label values tuple: number}."""
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [[self.name, dict(zip(self.labelnames, k)), v] for k, v in values.items()]
+
+class CounterFunc(Gauge):
+    """A counter maintained elsewhere (e.g. cache hit counts), read at collection time."""
+    type = 'counter'
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def timer(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            entries = [(k, list(counts), total, n) for k, (counts, total, n) in self._values.items()]
+        out = []
+        for key, counts, total, n in entries:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                out.append([f"{self.name}_bucket", {**labels, 'le': format_value(bound)}, cumulative])
+            out.append([f"{self.name}_sum", labels, total])
+            out.append([f"{self.name}_count", labels, n])
+        return out
+
+# Startup profile: how long each warm-up phase took, logged once and exported as a gauge
+startup_phases = {}
+process_started = time.perf_counter()
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = round(time.perf_counter() - started, 4)
+        logger.info(f"Startup: {name} took {startup_phases[name] * 1000:.0f}ms")
+
+def mark_ready(name):
+    """Record how long after this module was first imported `name` became ready."""
+    startup_phases[name] = round(time.perf_counter() - process_started, 4)
+    logger.info(f"Startup: {name} after {startup_phases[name] * 1000:.0f}ms")
+
+Gauge('startup_phase_seconds', "Duration of each startup phase", ('phase',),
+      lambda: {(k,): v for k, v in startup_phases.items()})
+
+def collect():
+    families = []
+    for metric in registry:
+        try:
+            families.append(metric.family())
+        except Exception as e:
+            logger.warning(f"Failed to collect metric {metric.name}: {e}")
+    return families
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+def render(snapshots):
+    """Merge (process, families) snapshots into one exposition, labelling each sample with its process."""
+    merged = {}
+    for process, families in snapshots:
+        for family in families:
+            entry = merged.setdefault(family['name'], {'type': family['type'], 'help': family['help'], 'samples': []})
+            entry['samples'].extend((name, {**labels, 'process': process}, value) for name, labels, value in family['samples'])
+    lines = []
+    for name, family in merged.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        lines.extend(f"{sample}{format_labels(labels)} {format_value(value)}" for sample, labels, value in family['samples'])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,196 @@
+import time
+import asyncio
+import itertools
+import logging
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import (
+    OUTBOUND_RATE, OUTBOUND_PRIVATE_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_DELETE_RATE, OUTBOUND_BURST, OUTBOUND_RETRIES
+)
+from metrics import Counter, Histogram, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first. Pass one as `rate_limit_args=` to ExtBot methods;
+# shortcuts like Message.reply_text can't take it and default to PRIORITY_USER.
+PRIORITY_USER = 0      # deliveries and replies someone is waiting on
+PRIORITY_ADMIN = 1     # ingest forwards and admin notices
+PRIORITY_LOG = 2       # LOG_CHANNEL digests
+PRIORITY_DELETE = 3    # self-destruct deletions
+PRIORITY_BACKFILL = 4  # channel backfill reads
+PRIORITY_NAMES = {
+    PRIORITY_USER: 'user', PRIORITY_ADMIN: 'admin', PRIORITY_LOG: 'log', PRIORITY_DELETE: 'delete', PRIORITY_BACKFILL: 'backfill'
+}
+
+# Calls that count against Telegram's flood limits; everything else (getFile, getChatMember, ...) goes straight through
+THROTTLED_ENDPOINTS = frozenset({
+    'sendMessage', 'sendVideo', 'sendDocument', 'sendPhoto', 'sendAnimation', 'sendMediaGroup',
+    'forwardMessage', 'copyMessage', 'editMessageText', 'editMessageCaption', 'deleteMessage'
+})
+
+outbound_calls = Counter('telegram_outbound_total', "Throttled Bot API calls by priority and outcome", ('priority', 'outcome'))
+outbound_wait = Histogram('telegram_outbound_wait_seconds', "Time throttled calls spend queued before sending", ('priority',))
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0.0) * self.rate)
+        self.updated = max(now, self.updated)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class OutboundJob:
+    __slots__ = ('chat_id', 'bucket', 'call', 'future', 'attempts', 'queued_at')
+
+    def __init__(self, chat_id, bucket, call, future):
+        self.chat_id = chat_id
+        self.bucket = bucket
+        self.call = call
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+class OutboundScheduler(BaseRateLimiter):
+    """Single gate for outgoing messages: one global and one per-chat token bucket, served in
+    priority order. A chat that is out of tokens (or told to back off by a 429) is parked
+    without holding up other chats, and calls hitting RetryAfter are re-queued behind it.
+
+    Deletions don't count against a chat's message limit, so they get a bucket of their own per
+    chat. `chat_rates` overrides the message rate for particular chats."""
+
+    def __init__(self, rate=OUTBOUND_RATE, private_rate=OUTBOUND_PRIVATE_RATE, group_rate=OUTBOUND_GROUP_RATE,
+                 delete_rate=OUTBOUND_DELETE_RATE, burst=OUTBOUND_BURST, max_retries=OUTBOUND_RETRIES, chat_rates=None):
+        self.global_bucket = TokenBucket(rate, max(rate, 1))
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.delete_rate = delete_rate
+        self.chat_rates = dict(chat_rates or {})
+        self.burst = burst
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.parked = 0
+        self._seq = itertools.count()
+        self._queue = None
+        self._dispatcher = None
+        self._inflight = set()
+        Gauge('telegram_outbound_queued', "Throttled calls waiting to be sent", collect=self.queued)
+
+    def queued(self):
+        return (self._queue.qsize() if self._queue else 0) + self.parked
+
+    async def initialize(self):
+        # Both the Application and its Updater initialize the bot
+        if self._dispatcher:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if not self._dispatcher:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in THROTTLED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        if rate_limit_args is None:
+            rate_limit_args = PRIORITY_DELETE if endpoint == 'deleteMessage' else PRIORITY_USER
+        chat_id = data.get('chat_id')
+        bucket = (chat_id, 'delete') if endpoint == 'deleteMessage' else chat_id
+        job = OutboundJob(chat_id, bucket, lambda: callback(*args, **kwargs), asyncio.get_running_loop().create_future())
+        self._queue.put_nowait((rate_limit_args, next(self._seq), job))
+        return await job.future
+
+    def _chat_bucket(self, key):
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if isinstance(key, tuple):
+                rate = self.delete_rate
+            elif key in self.chat_rates:
+                rate = self.chat_rates[key]
+            else:
+                rate = self.private_rate if isinstance(key, int) and key > 0 else self.group_rate
+            bucket = self.chat_buckets[key] = TokenBucket(rate, self.burst)
+        return bucket
+
+    def _park(self, item, delay):
+        def unpark():
+            self.parked -= 1
+            self._queue.put_nowait(item)
+        self.parked += 1
+        asyncio.get_running_loop().call_later(delay, unpark)
+
+    def _prune(self, now):
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.idle(now)]:
+            del self.chat_buckets[chat_id]
+
+    async def _dispatch(self):
+        while True:
+            item = await self._queue.get()
+            job = item[2]
+            if job.future.done():
+                continue
+            now = time.monotonic()
+            bucket = self._chat_bucket(job.bucket)
+            wait = bucket.wait_time(now)
+            if wait > 0:
+                self._park(item, wait)
+                continue
+            wait = self.global_bucket.wait_time(now)
+            if wait > 0:
+                # Put it back so whatever is most urgent goes first once a token frees up
+                self._queue.put_nowait(item)
+                await asyncio.sleep(wait)
+                continue
+            self.global_bucket.take()
+            bucket.take()
+            task = asyncio.create_task(self._send(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            if len(self.chat_buckets) > 10000:
+                self._prune(now)
+
+    async def _send(self, item):
+        priority, _, job = item
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        if not job.attempts:
+            outbound_wait.observe(time.monotonic() - job.queued_at, priority=label)
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            outbound_calls.inc(priority=label, outcome='rate_limited')
+            bucket = self._chat_bucket(job.bucket)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + e.retry_after)
+            if job.attempts < self.max_retries and not job.future.done():
+                job.attempts += 1
+                logger.warning(f"Flood limit for chat {job.chat_id}, retrying in {e.retry_after}s")
+                self._queue.put_nowait(item)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            outbound_calls.inc(priority=label, outcome='failed')
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            outbound_calls.inc(priority=label, outcome='sent')
+            if not job.future.done():
+                job.future.set_result(result)
@@ -0,0 +1,35 @@
+#!/bin/bash
+# APP_MODE picks the process layout:
+#   split (default) - bot process + multi-worker gunicorn web tier sharing static/thumbnails
+#   web / bot       - just one side, for running them as separate services. Like split, they must share
+#                     THUMBNAILS_DIR (the bot writes thumbnails, the web tier serves them), so on separate
+#                     hosts point it at shared storage. In webhook mode the web tier relays to the bot on
+#                     127.0.0.1; across hosts set BOT_WEBHOOK_LISTEN on the bot and BOT_WEBHOOK_RELAY on the web
+#   all             - legacy single process (Flask dev server thread + bot)
+# Per-request access logs are off unless WEB_ACCESS_LOG is set; request counts are on /metrics
+set -e
+PORT="${PORT:-5000}"
+WEB_CMD="gunicorn web:app --bind 0.0.0.0:${PORT} --worker-class gthread --workers ${WEB_WORKERS:-3} --threads ${WEB_THREADS:-8}${WEB_ACCESS_LOG:+ --access-logfile -}"
+
+case "${APP_MODE:-split}" in
+  all)
+    exec python app.py
+    ;;
+  web)
+    APP_ROLE=web exec $WEB_CMD
+    ;;
+  bot)
+    APP_ROLE=bot exec python bot.py
+    ;;
+  split)
+    APP_ROLE=bot python bot.py &
+    APP_ROLE=web $WEB_CMD &
+    # If either side dies, exit so the platform restarts the container
+    wait -n
+    exit $?
+    ;;
+  *)
+    echo "Unknown APP_MODE: ${APP_MODE}" >&2
+    exit 1
+    ;;
+esac
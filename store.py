@@ -0,0 +1,229 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from threading import Lock
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ASCENDING, DESCENDING, TEXT
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+from config import (
+    MONGODB_URI, DB_NAME, APP_ROLE, MONGO_WEB_POOL, MONGO_BOT_POOL,
+    VIDEO_CACHE_SIZE, VIDEO_CACHE_TTL, VERSION_POLL, DEFAULT_CATEGORY, STATS_INTERVAL
+)
+from metrics import Histogram, Counter, Gauge, CounterFunc, collect, process_name
+
+logger = logging.getLogger(__name__)
+
+# MongoDB setup: each process sizes its pool for its role. Flask threads use the client directly;
+# the bot goes through run_db(), whose executor caps it at MONGO_BOT_POOL connections
+POOL_SIZES = {'web': MONGO_WEB_POOL, 'bot': MONGO_BOT_POOL}
+mongo_latency = Histogram('mongo_command_duration_seconds', "MongoDB command round trips", ('command',))
+mongo_failures = Counter('mongo_command_failures_total', "Failed MongoDB commands", ('command',))
+
+class CommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_latency.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        mongo_latency.observe(event.duration_micros / 1e6, command=event.command_name)
+        mongo_failures.inc(command=event.command_name)
+
+client = MongoClient(
+    MONGODB_URI,
+    maxPoolSize=POOL_SIZES.get(APP_ROLE, MONGO_WEB_POOL + MONGO_BOT_POOL),
+    event_listeners=[CommandTimer()],
+    connect=False  # connect on first use, not at import
+)
+db = client[DB_NAME]
+videos = db.videos
+users = db.users
+meta = db.meta
+ingest_jobs = db.ingest_jobs
+deletions = db.deletions
+metric_snapshots = db.metrics
+
+# Async data access for the bot loop: blocking pymongo calls run on a dedicated executor
+db_executor = ThreadPoolExecutor(max_workers=MONGO_BOT_POOL, thread_name_prefix='mongo')
+db_metrics = {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_s': 0.0}
+async def run_db(fn, *args, **kwargs):
+    def timed():
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            db_metrics['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            db_metrics['calls'] += 1
+            db_metrics['seconds'] += elapsed
+            db_metrics['max_s'] = max(db_metrics['max_s'], elapsed)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, timed)
+
+def ensure_indexes():
+    videos.create_index([('title', TEXT)], name='title_text', default_language='none')
+    videos.create_index([('category', ASCENDING), ('_id', DESCENDING)])
+    # Records from before catalogs were partitioned all belong to the default one
+    backfilled = videos.update_many({'category': {'$exists': False}}, {'$set': {'category': DEFAULT_CATEGORY}})
+    if backfilled.modified_count:
+        logger.info(f"Tagged {backfilled.modified_count} legacy videos as {DEFAULT_CATEGORY}")
+    try:
+        videos.create_index('custom_key', unique=True)
+    except OperationFailure as e:
+        logger.warning(f"custom_key is not unique yet, run `python app.py compact`: {e}")
+    ingest_jobs.create_index([('status', ASCENDING), ('run_at', ASCENDING)])
+    ingest_jobs.create_index('finished_at', expireAfterSeconds=86400)
+    # Bots can only delete messages younger than 48h; anything older is dropped by Mongo
+    deletions.create_index('due_at', expireAfterSeconds=172800)
+    # Snapshots from processes that have since restarted
+    metric_snapshots.create_index('updated_at', expireAfterSeconds=3600)
+
+named_caches = {}
+Gauge('cache_entries', "Entries held per in-process cache", ('cache',),
+      lambda: {(n,): len(c._data) for n, c in named_caches.items()})
+CounterFunc('cache_hits_total', "Cache hits per in-process cache", ('cache',),
+            lambda: {(n,): c.hits for n, c in named_caches.items()})
+CounterFunc('cache_misses_total', "Cache misses per in-process cache", ('cache',),
+            lambda: {(n,): c.misses for n, c in named_caches.items()})
+
+# Bounded LRU cache with per-entry TTL, safe to share between Flask threads and the bot loop
+class LRUCache:
+    def __init__(self, maxsize, ttl, name=None):
+        if name:
+            named_caches[name] = self
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
+
+video_cache = LRUCache(VIDEO_CACHE_SIZE, VIDEO_CACHE_TTL, 'video')
+
+# Catalog version: bumped on every ingest, polled so other processes drop stale entries
+_catalog_version = {'value': None, 'checked': 0.0}
+
+def catalog_version():
+    now = time.monotonic()
+    if now - _catalog_version['checked'] < VERSION_POLL:
+        return _catalog_version['value']
+    _catalog_version['checked'] = now
+    doc = meta.find_one({'_id': 'catalog'})
+    version = doc['version'] if doc else 0
+    if version != _catalog_version['value']:
+        video_cache.clear()
+        _catalog_version['value'] = version
+    return version
+
+def bump_catalog_version():
+    doc = meta.find_one_and_update({'_id': 'catalog'}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+    if doc['version'] != (_catalog_version['value'] or 0) + 1:
+        # Someone else ingested since our last poll
+        video_cache.clear()
+    _catalog_version['value'] = doc['version']
+    _catalog_version['checked'] = time.monotonic()
+    return doc['version']
+
+def get_video(key):
+    catalog_version()
+    found, rec = video_cache.get(key)
+    if found:
+        return rec
+    rec = videos.find_one({'custom_key': key})
+    video_cache.set(key, rec)
+    return rec
+
+def record_videos(docs):
+    # Upsert on custom_key so replays and duplicate posts never add copies
+    docs = list({d['custom_key']: d for d in docs}.values())
+    ops = []
+    for doc in docs:
+        fields = {k: v for k, v in doc.items() if v is not None}
+        on_insert = {k: None for k, v in doc.items() if v is None}
+        update = {'$set': fields}
+        if on_insert:
+            update['$setOnInsert'] = on_insert
+        ops.append(UpdateOne({'custom_key': doc['custom_key']}, update, upsert=True))
+    videos.bulk_write(ops, ordered=False)
+    bump_catalog_version()
+    # Upserts keep fields the submitted docs left as None, so the docs themselves aren't the stored records
+    for doc in docs:
+        video_cache.pop(doc['custom_key'])
+
+def compact_catalog():
+    """Merge duplicate custom_key records into the oldest one, then enforce uniqueness."""
+    groups = removed = 0
+    dupes = videos.aggregate([
+        {'$group': {'_id': '$custom_key', 'ids': {'$push': '$_id'}, 'n': {'$sum': 1}}},
+        {'$match': {'n': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    for group in dupes:
+        recs = list(videos.find({'_id': {'$in': group['ids']}}).sort('_id', ASCENDING))
+        keeper, extra = recs[0], recs[1:]
+        merged = {}
+        for rec in extra:
+            for k, v in rec.items():
+                if k != '_id' and v is not None and keeper.get(k) is None:
+                    merged.setdefault(k, v)
+        if merged:
+            videos.update_one({'_id': keeper['_id']}, {'$set': merged})
+        removed += videos.delete_many({'_id': {'$in': [r['_id'] for r in extra]}}).deleted_count
+        groups += 1
+    videos.create_index('custom_key', unique=True)
+    bump_catalog_version()
+    logger.info(f"Compacted {groups} duplicated keys, removed {removed} records")
+    return groups, removed
+
+# Metrics from processes that don't answer /metrics themselves, merged by the web tier at scrape time
+def publish_metrics():
+    metric_snapshots.replace_one(
+        {'_id': process_name()},
+        {'families': collect(), 'updated_at': datetime.utcnow()},
+        upsert=True
+    )
+
+def load_metric_snapshots():
+    fresh = datetime.utcnow() - timedelta(seconds=STATS_INTERVAL * 3)
+    return [(s['_id'], s['families']) for s in metric_snapshots.find({'_id': {'$ne': process_name()}, 'updated_at': {'$gte': fresh}})]
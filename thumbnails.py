@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import logging
+from threading import Event, Lock
+from config import THUMBNAILS_DIR, VIDEO_CACHE_SIZE, THUMB_MISS_TTL, THUMB_RECHECK_INTERVAL
+from store import LRUCache
+from metrics import Histogram, startup_phase
+
+logger = logging.getLogger(__name__)
+
+# Resized derivatives live in per-width subdirectories: static/thumbnails/<width>/<key>.<fmt>
+# cv2 is imported where it is used: it costs ~100ms and tens of MB, and only thumbnail work needs it
+THUMB_WIDTHS = (160, 320, 640)
+THUMB_FORMATS = {'webp': ('.webp', 'IMWRITE_WEBP_QUALITY', 70), 'jpg': ('.jpg', 'IMWRITE_JPEG_QUALITY', 80)}
+
+thumbnail_stage_latency = Histogram(
+    'thumbnail_stage_duration_seconds', "Thumbnail pipeline stage durations", ('stage',)
+)
+
+def thumb_srcset(key, fmt, version=None):
+    query = f"?v={version}" if version else ''
+    return ', '.join(f"/thumbnails/{w}/{key}.{fmt}{query} {w}w" for w in THUMB_WIDTHS)
+
+def generate_derivatives(key):
+    import cv2
+    img = cv2.imread(os.path.join(THUMBNAILS_DIR, f"{key}.jpg"))
+    if img is None:
+        return False
+    h, w = img.shape[:2]
+    for width in THUMB_WIDTHS:
+        if width < w:
+            resized = cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        else:
+            resized = img
+        for fmt, (ext, param, quality) in THUMB_FORMATS.items():
+            ok, data = cv2.imencode(ext, resized, [getattr(cv2, param), quality])
+            if not ok:
+                continue
+            name = f"{width}/{key}.{fmt}"
+            with open(os.path.join(THUMBNAILS_DIR, name), 'wb') as f:
+                f.write(data.tobytes())
+            index_thumbnail(name)
+    return True
+
+def extract_frame(video_path, thumbnail_path, at_ms=1000):
+    """Runs in a pool worker: grab the frame at `at_ms` and write it as JPEG. Returns False if it is not decodable."""
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return False
+        cap.set(cv2.CAP_PROP_POS_MSEC, at_ms)
+        ret, frame = cap.read()
+        if not ret:
+            return False
+        tmp_path = f"{thumbnail_path}.tmp.jpg"
+        if not cv2.imwrite(tmp_path, frame):
+            return False
+        os.replace(tmp_path, thumbnail_path)
+        return True
+    finally:
+        cap.release()
+
+async def build_derivatives(key):
+    try:
+        with thumbnail_stage_latency.timer(stage='derivatives'):
+            return await asyncio.to_thread(generate_derivatives, key)
+    except Exception as e:
+        logger.error(f"Failed to build thumbnail derivatives for key {key}: {e}")
+        return False
+
+async def backfill_derivatives():
+    pending = [n[:-4] for n in list(thumbnail_index) if '/' not in n and f"{THUMB_WIDTHS[0]}/{n[:-4]}.webp" not in thumbnail_index]
+    for key in pending:
+        await build_derivatives(key)
+    if pending:
+        logger.info(f"Built thumbnail derivatives for {len(pending)} legacy thumbnails")
+
+# In-memory index of thumbnail files on disk, keyed by path relative to THUMBNAILS_DIR:
+# name -> (etag, mtime, when we last looked). Other processes may rewrite a file, so entries are re-checked.
+thumbnail_index = {}
+thumbnail_index_ready = Event()
+_index_lock = Lock()
+missing_thumbnails = LRUCache(VIDEO_CACHE_SIZE, THUMB_MISS_TTL, 'missing_thumbnails')
+
+def _thumbnail_entry(st):
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}", st.st_mtime, time.monotonic()
+
+def index_thumbnail(name):
+    try:
+        st = os.stat(os.path.join(THUMBNAILS_DIR, name))
+    except OSError:
+        thumbnail_index.pop(name, None)
+        return None
+    entry = thumbnail_index[name] = _thumbnail_entry(st)
+    missing_thumbnails.pop(name)
+    return entry
+
+def lookup_thumbnail(name):
+    """Index entry for `name`, stat'ed again once it is THUMB_RECHECK_INTERVAL old."""
+    entry = thumbnail_index.get(name)
+    if entry and time.monotonic() - entry[2] > THUMB_RECHECK_INTERVAL:
+        entry = index_thumbnail(name)
+    return entry
+
+def thumb_version(key):
+    """The original's ETag, used as ?v= on thumbnail URLs so a rewritten thumbnail gets new URLs.
+    Derivatives share it: they are rebuilt right after the original is written."""
+    name = f"{key}.jpg"
+    entry = lookup_thumbnail(name)
+    if not entry:
+        # Not indexed yet (index still building, or written by the bot since): one stat, remembered if missing
+        known_missing, _ = missing_thumbnails.get(name)
+        entry = None if known_missing else index_thumbnail(name)
+        if not entry:
+            missing_thumbnails.set(name, True)
+    return entry[0] if entry else None
+
+def build_thumbnail_index():
+    # The web tier builds this in the background while serving (misses fall back to a stat),
+    # so a second caller just waits for the first scan
+    with _index_lock:
+        if thumbnail_index_ready.is_set():
+            return
+        with startup_phase('thumbnail_index'):
+            for sub in ('', *map(str, THUMB_WIDTHS)):
+                prefix = f"{sub}/" if sub else ''
+                os.makedirs(os.path.join(THUMBNAILS_DIR, sub), exist_ok=True)
+                with os.scandir(os.path.join(THUMBNAILS_DIR, sub)) as it:
+                    for e in it:
+                        if e.name.endswith(('.jpg', '.webp')) and e.is_file():
+                            thumbnail_index[prefix + e.name] = _thumbnail_entry(e.stat())
+        thumbnail_index_ready.set()
+        logger.info(f"Indexed {len(thumbnail_index)} thumbnail files")
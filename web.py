@@ -0,0 +1,326 @@
+import time
+import gzip
+import base64
+import hmac
+import hashlib
+import logging
+from threading import Thread
+from flask import Flask, Response, render_template, jsonify, make_response, send_from_directory, request, redirect, g
+from pymongo import DESCENDING
+from bson import ObjectId
+from werkzeug.exceptions import NotFound
+from config import (
+    BOT_USERNAME, PAGE_SIZE, MAX_PAGE_SIZE, THUMBNAILS_DIR, THUMB_MISS_TTL, THUMB_MAX_AGE, THUMB_RECHECK_INTERVAL,
+    BOT_MODE, BOT_WEBHOOK_RELAY, WEBHOOK_SECRET, PAGE_CACHE_SIZE, PAGE_CACHE_TTL,
+    DEFAULT_CATEGORY, CATEGORIES, CATEGORY_TEMPLATES, APP_ROLE, STATS_INTERVAL
+)
+from store import (
+    videos, meta, video_cache, catalog_version, get_video, LRUCache, publish_metrics, load_metric_snapshots
+)
+from metrics import Counter, Histogram, Gauge, collect, render, process_name, startup_phases, mark_ready
+from thumbnails import (
+    THUMB_WIDTHS, thumb_srcset, thumb_version, thumbnail_index, thumbnail_index_ready, missing_thumbnails, index_thumbnail,
+    lookup_thumbnail, build_thumbnail_index
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Initialize Flask app
+app = Flask(__name__)
+# Bottom nav links for the configured catalogs only, default first
+catalog_nav = [(DEFAULT_CATEGORY, '/')] + [(c, f"/c/{c}") for c in sorted(CATEGORIES - {DEFAULT_CATEGORY})]
+app.jinja_env.globals.update(thumb_srcset=thumb_srcset, thumb_widths=THUMB_WIDTHS, catalog_nav=catalog_nav)
+
+# Request metrics, labelled by URL rule so /file/<key> stays one series
+http_requests = Counter('http_requests_total', "HTTP responses by route and status", ('route', 'status'))
+http_latency = Histogram('http_request_duration_seconds', "Flask request latency by route", ('route',))
+Gauge('thumbnail_files', "Thumbnail files in the on-disk index", collect=lambda: len(thumbnail_index))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_latency.observe(time.perf_counter() - g.request_started, route=route)
+    http_requests.inc(route=route, status=response.status_code)
+    return response
+
+# Catalog pagination (keyset on _id, newest first)
+def encode_cursor(oid):
+    return base64.urlsafe_b64encode(oid.binary).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        return None
+
+def fetch_videos_page(category, cursor=None, limit=PAGE_SIZE):
+    query = {'category': category}
+    if cursor:
+        query['_id'] = {'$lt': cursor}
+    docs = list(videos.find(query).sort('_id', -1).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]['_id']) if len(docs) > limit else None
+    return with_thumb_versions(docs[:limit]), next_cursor
+
+def search_videos(category, term, page=0, limit=PAGE_SIZE):
+    score = {'$meta': 'textScore'}
+    docs = list(
+        videos.find({'$text': {'$search': term}, 'category': category}, {'_id': 0, 'score': score})
+        .sort([('score', score), ('_id', DESCENDING)])
+        .skip(page * limit)
+        .limit(limit + 1)
+    )
+    for d in docs:
+        del d['score']
+    return with_thumb_versions(docs[:limit]), (page + 1 if len(docs) > limit else None)
+
+def versioned_thumbnail_url(url, version):
+    return f"{url}?v={version}" if url and version else url
+
+def with_thumb_versions(docs):
+    # Thumbnail URLs carry the file's version, so a rewritten thumbnail never hides behind a year-long max-age
+    for d in docs:
+        d['thumb_version'] = thumb_version(d['custom_key'])
+        d['thumbnail_url'] = versioned_thumbnail_url(d.get('thumbnail_url'), d['thumb_version'])
+    return docs
+
+# Rendered catalog bodies, keyed by catalog version so an ingest retires them all at once.
+# Each entry holds the identity, gzip and (if available) brotli encodings.
+page_cache = LRUCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL, 'page')
+
+def build_page(body, mimetype):
+    body = body.encode()
+    return {
+        'etag': hashlib.sha1(body).hexdigest()[:20],
+        'mimetype': mimetype,
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=9),
+        'br': brotli.compress(body, quality=9) if brotli else None
+    }
+
+def cached_page(key, mimetype, render):
+    version = catalog_version()
+    found, page = page_cache.get((version, *key))
+    if not found:
+        page = build_page(render(), mimetype)
+        page_cache.set((version, *key), page)
+    # One strong ETag per encoding; any of them proves the client holds the current body
+    etags = {enc: f"{page['etag']}-{enc}" for enc in ('identity', 'gzip', 'br')}
+    accepted = request.accept_encodings
+    if page['br'] is not None and accepted.quality('br'):
+        encoding = 'br'
+    elif accepted.quality('gzip'):
+        encoding = 'gzip'
+    else:
+        encoding = 'identity'
+    matched = next((tag for tag in etags.values() if tag in request.if_none_match), None)
+    if matched:
+        # Repeat the validator of the variant the client holds, not the one we would send
+        response = make_response('', 304)
+        response.set_etag(matched)
+    else:
+        response = make_response(page[encoding])
+        response.mimetype = page['mimetype']
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(etags[encoding])
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def register_routes():
+    def render_catalog(category, template):
+        def render():
+            vids, next_cursor = fetch_videos_page(category)
+            return render_template(template, videos=vids, next_cursor=next_cursor, category=category, bot_username=BOT_USERNAME)
+        return cached_page(('catalog', category), 'text/html', render)
+
+    @app.route('/')
+    def index():
+        return render_catalog(DEFAULT_CATEGORY, 'index.html')
+
+    @app.route('/c/<category>')
+    def category_page(category):
+        if category == DEFAULT_CATEGORY:
+            return redirect('/')
+        if category not in CATEGORIES:
+            return "Catalog not found", 404
+        return render_catalog(category, CATEGORY_TEMPLATES.get(category, 'index.html'))
+
+    @app.route('/file/<key>')
+    def file_page(key):
+        rec = get_video(key)
+        if not rec:
+            return "File not found", 404
+        category = rec.get('category', DEFAULT_CATEGORY)
+        catalog_url = '/' if category == DEFAULT_CATEGORY else f"/c/{category}"
+        version = thumb_version(key)
+        return render_template('file.html', key=key, thumb_url=versioned_thumbnail_url(rec.get('thumbnail_url', ''), version),
+                               thumb_version=version, title=rec.get('title', 'Untitled'), catalog_url=catalog_url, bot_username=BOT_USERNAME)
+
+    @app.route('/api/videos')
+    def api_videos():
+        category = request.args.get('category', DEFAULT_CATEGORY)
+        if category not in CATEGORIES:
+            return jsonify({'error': 'unknown category'}), 404
+        cursor = request.args.get('cursor')
+        oid = decode_cursor(cursor) if cursor else None
+        if cursor and not oid:
+            return jsonify({'error': 'invalid cursor'}), 400
+        limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        def render():
+            vids, next_cursor = fetch_videos_page(category, oid, limit)
+            for v in vids:
+                del v['_id']
+            return app.json.dumps({'videos': vids, 'next': next_cursor})
+        return cached_page(('videos', category, cursor, limit), 'application/json', render)
+
+    @app.route('/api/search')
+    def api_search():
+        category = request.args.get('category', DEFAULT_CATEGORY)
+        if category not in CATEGORIES:
+            return jsonify({'error': 'unknown category'}), 404
+        term = request.args.get('q', '').strip()
+        if not term:
+            return jsonify({'videos': [], 'next': None})
+        page = max(request.args.get('page', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        vids, next_page = search_videos(category, term[:100], page, limit)
+        return jsonify({'videos': vids, 'next': next_page})
+
+    @app.route('/healthz')
+    def healthz():
+        # Touches nothing slow, so it answers as soon as the process can serve; warm-up is reported, not awaited
+        return jsonify({
+            'status': 'ok',
+            'role': APP_ROLE,
+            'thumbnail_index': 'ready' if thumbnail_index_ready.is_set() else 'building',
+            'startup': startup_phases
+        })
+
+    @app.route('/metrics')
+    def metrics():
+        snapshots = [(process_name(), collect())] + load_metric_snapshots()
+        return Response(render(snapshots), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/stats')
+    def stats():
+        # Bot-side numbers are published to meta by the bot process every STATS_INTERVAL
+        bot_stats = meta.find_one({'_id': 'bot_stats'}, {'_id': 0})
+        return jsonify({
+            'web': {
+                'video_cache': video_cache.stats(),
+                'page_cache': page_cache.stats(),
+                'missing_thumbnails': missing_thumbnails.stats(),
+                'thumbnail_files': len(thumbnail_index),
+                'catalog_version': catalog_version()
+            },
+            'bot': bot_stats
+        })
+
+    if BOT_MODE == 'webhook':
+        import httpx  # only the relay needs it, and it is a slow import
+        webhook_relay = httpx.Client(base_url=BOT_WEBHOOK_RELAY, timeout=10)
+
+        @app.route('/telegram/<secret>', methods=['POST'])
+        def telegram_webhook(secret):
+            header = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            # compare_digest rejects non-ASCII str, so compare bytes and let junk fall through to the 404
+            expected = WEBHOOK_SECRET.encode()
+            if not (hmac.compare_digest(secret.encode(), expected) and hmac.compare_digest(header.encode(), expected)):
+                return "Not found", 404
+            try:
+                r = webhook_relay.post('/telegram', content=request.get_data(), headers={
+                    'Content-Type': 'application/json',
+                    'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET
+                })
+            except httpx.HTTPError as e:
+                # Telegram retries non-2xx deliveries, so nothing is lost while the bot restarts
+                logger.warning(f"Webhook relay to bot failed: {e}")
+                return "Bot unavailable", 503
+            return '', r.status_code
+
+    @app.route('/favicon.ico')
+    def favicon():
+        return send_from_directory('static', 'fallback.jpg', mimetype='image/jpeg')
+
+    def fallback_thumbnail():
+        return send_from_directory('static', 'fallback.jpg', max_age=THUMB_MISS_TTL)
+
+    def send_thumbnail(name, key):
+        entry = lookup_thumbnail(name)
+        if entry and request.if_none_match and entry[0] not in request.if_none_match:
+            # The client may hold a file written after we last looked
+            entry = index_thumbnail(name)
+        if not entry:
+            known_missing, _ = missing_thumbnails.get(name)
+            entry = None if known_missing else index_thumbnail(name)
+            if not entry:
+                missing_thumbnails.set(name, True)
+                logger.debug(f"No thumbnail file: {name}")
+                return None
+        etag, mtime, _ = entry
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and since.timestamp() >= int(mtime)
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            try:
+                response = send_from_directory(THUMBNAILS_DIR, name, etag=False, last_modified=mtime)
+            except NotFound:
+                logger.warning(f"Thumbnail file missing: {name}")
+                thumbnail_index.pop(name, None)
+                return None
+        response.set_etag(etag)
+        version = request.args.get('v')
+        if version and version == thumb_version(key):
+            response.headers['Cache-Control'] = f'public, max-age={THUMB_MAX_AGE}, immutable'
+        else:
+            # Unversioned (or outdated) URLs can be rewritten in place, so clients revalidate
+            response.headers['Cache-Control'] = f'public, max-age={int(THUMB_RECHECK_INTERVAL)}'
+        return response
+
+    @app.route('/thumbnails/<key>.jpg')
+    def serve_thumbnail(key):
+        return send_thumbnail(f"{key}.jpg", key) or fallback_thumbnail()
+
+    @app.route('/thumbnails/<int:width>/<key>.<any(webp, jpg):fmt>')
+    def serve_thumbnail_variant(width, key, fmt):
+        if width not in THUMB_WIDTHS:
+            return "Unknown thumbnail size", 404
+        response = send_thumbnail(f"{width}/{key}.{fmt}", key)
+        if response:
+            return response
+        # Derivative not built yet: point at the original rather than the placeholder
+        if lookup_thumbnail(f"{key}.jpg") or index_thumbnail(f"{key}.jpg"):
+            response = redirect(versioned_thumbnail_url(f"/thumbnails/{key}.jpg", request.args.get('v')))
+            response.headers['Cache-Control'] = f'public, max-age={THUMB_MISS_TTL}'
+            return response
+        return fallback_thumbnail()
+
+def publish_web_metrics():
+    # Prometheus scrapes one gunicorn worker at a time; the others reach it through Mongo
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            publish_metrics()
+        except Exception as e:
+            logger.error(f"Failed to publish web metrics: {e}")
+
+register_routes()
+# Serve straight away; until the scan finishes, thumbnail lookups fall back to a stat per file
+Thread(target=build_thumbnail_index, daemon=True).start()
+if APP_ROLE == 'web':
+    Thread(target=publish_web_metrics, daemon=True).start()
+mark_ready('web')
@@ -0,0 +1,97 @@
+"""Post synthetic Telegram updates to the webhook endpoint.
+
+    python webhook_harness.py --kind start --count 500 --concurrency 20 --key file_abc
+
+Replies the bot makes for these fake users go to the real Bot API unless the bot
+is pointed at a stand-in server, so use a test token or a local API.
+
+`--kind channel` posts media to the real CHANNEL_ID with fake file ids, and the bot
+catalogs every one of them. It only runs with --write-catalog; point the bot at a
+throwaway DB_NAME first.
+"""
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+import httpx
+from config import PORT, CHANNEL_ID, WEBHOOK_SECRET
+
+_ids = itertools.count(int(time.time()))
+
+def start_update(user_id, key=None):
+    n = next(_ids)
+    text = f"/start {key}" if key else "/start"
+    return {
+        'update_id': n,
+        'message': {
+            'message_id': n,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        }
+    }
+
+def channel_update(title=None):
+    n = next(_ids)
+    return {
+        'update_id': n,
+        'channel_post': {
+            'message_id': n,
+            'date': int(time.time()),
+            'chat': {'id': CHANNEL_ID, 'type': 'channel', 'title': 'Harness'},
+            'caption': title or f"Synthetic {n}",
+            'document': {'file_id': f"synthetic-{n}", 'file_unique_id': f"syn{n}"}
+        }
+    }
+
+async def post_updates(url, updates, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    r = await client.post(url, json=update, headers=headers)
+                    statuses[r.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=f"http://127.0.0.1:{PORT}/telegram/{WEBHOOK_SECRET}")
+    parser.add_argument('--kind', choices=['start', 'channel'], default='start')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--key', help="deep-link key for /start updates")
+    parser.add_argument('--user-id', type=int, default=1_000_000, help="first synthetic user id")
+    parser.add_argument('--write-catalog', action='store_true', help="allow --kind channel, which adds junk catalog records")
+    args = parser.parse_args()
+    if args.kind == 'channel' and not args.write_catalog:
+        parser.error("--kind channel writes fake records into the bot's catalog; use a throwaway DB_NAME and pass --write-catalog")
+
+    if args.kind == 'start':
+        updates = [start_update(args.user_id + i, args.key) for i in range(args.count)]
+    else:
+        updates = [channel_update() for _ in range(args.count)]
+    latencies, statuses, elapsed = asyncio.run(post_updates(args.url, updates, args.concurrency))
+    print(f"{args.count} updates in {elapsed:.2f}s ({args.count / elapsed:.1f}/s)")
+    print(f"status: {dict(statuses)}")
+    print(f"latency ms: p50={percentile(latencies, 50) * 1000:.1f} "
+          f"p95={percentile(latencies, 95) * 1000:.1f} p99={percentile(latencies, 99) * 1000:.1f}")
+
+if __name__ == '__main__':
+    main()